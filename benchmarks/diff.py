@@ -0,0 +1,75 @@
+"""features.diff() vs the pandas BitcoinEnv._diff it replaced: speed (per-column pandas vs whole-matrix NumPy) and
+equivalence, on synthetic columns w/ holes and zero-volume rows (pct-change infs). Also times the rolling-outlier
+variant (hypers.rolling_outliers), which isn't meant to match.
+
+Eg `python -m benchmarks.diff --sizes 100000 1000000`
+"""
+
+import argparse, time
+import numpy as np
+import pandas as pd
+
+from benchmarks import synthetic, results
+import features
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000, 1000000], help="Rows")
+parser.add_argument('--tables', type=int, default=2)
+parser.add_argument('--nan-frac', type=float, default=.01)
+parser.add_argument('--repeat', type=int, default=3, help="Best-of this many timings")
+parser.add_argument('--out', type=str, default='bench_diff.jsonl')
+args = parser.parse_args()
+
+
+def legacy_diff(arr, percent=False):
+    """BitcoinEnv._diff before features.diff(). ffill() before pct_change() is what pct_change() did by default
+    (fill_method='pad') in the pandas this was written against"""
+    series = pd.Series(arr)
+    diff = series.ffill().pct_change() if percent else series.diff()
+    diff.iloc[0] = 0  # always NaN, nothing to compare to
+
+    # Remove outliers (turn them to NaN)
+    q = diff.quantile(0.99)
+    diff = diff.mask(diff > q, np.nan)
+
+    # then forward-fill the NaNs.
+    return diff.replace([np.inf, -np.inf], np.nan).ffill().bfill().values
+
+
+def best_of(fn):
+    times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        ret = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), ret
+
+
+def main():
+    tables = synthetic.make_tables(args.tables)
+    out = []
+    for n_rows in args.sizes:
+        df = synthetic.random_walk(n_rows, tables, nan_frac=args.nan_frac)
+        # zero-volume minutes, like Z-imputed holes
+        for c in df.columns:
+            if 'volume' in c: df.loc[df[c].isnull(), c] = 0.
+        X = df.values
+        for percent in (False, True):
+            legacy_s, legacy = best_of(lambda: np.column_stack([legacy_diff(df[c], percent) for c in df.columns]))
+            numpy_s, new = best_of(lambda: features.diff(X, percent))
+            rolling_s, _ = best_of(lambda: features.diff(X, percent, outlier_window=features.OUTLIER_WINDOW))
+            a, b = np.nan_to_num(legacy), np.nan_to_num(new)
+            res = results.stamp(dict(
+                rows=n_rows, cols=X.shape[1], percent=percent,
+                legacy_s=legacy_s, numpy_s=numpy_s, rolling_s=rolling_s, speedup=legacy_s / numpy_s,
+                equal=bool(np.allclose(a, b, rtol=1e-9, atol=1e-12)),
+                max_abs_diff=float(np.max(np.abs(a - b)))
+            ))
+            print('\t'.join(f"{k}:{round(v, 4) if type(v) == float else v}" for k, v in res.items()
+                            if k not in ('commit', 'time')))
+            out.append(res)
+    results.write(args.out, out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Throughput of BitcoinEnv's hot loop on synthetic data: use_dataset() (transform time & peak memory), reset() and
+execute() (steps/sec, random actions). Sweeps net-type, `scale`, `indicators`, `arbitrage` and dataset size; results
+go to a JSON-lines file tagged w/ the commit, so runs can be compared across commits (--baseline).
+
+Eg `python -m benchmarks.env --sizes 100000 1000000 5000000 --baseline bench_env.jsonl`
+"""
+
+import argparse, itertools, resource, time, tracemalloc
+import numpy as np
+
+from benchmarks import synthetic, results
+import btc_env
+from btc_env import BitcoinEnv, Mode
+from hypersearch import HSearchEnv
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--net-types', nargs='+', default=['conv2d', 'lstm'])
+parser.add_argument('--scale', nargs='+', type=int, default=[0, 1], help="Sweep `scale` over these (0/1)")
+parser.add_argument('--indicators', nargs='+', type=int, default=[0, 1])
+parser.add_argument('--arbitrage', nargs='+', type=int, default=[0, 1])
+parser.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000, 1000000], help="Dataset sizes (rows)")
+parser.add_argument('--tables', type=int, default=2, help="Num exchanges (arbitrage uses all of them)")
+parser.add_argument('--steps', type=int, default=5000, help="execute() steps per config")
+parser.add_argument('--out', type=str, default='bench_env.jsonl')
+parser.add_argument('--baseline', type=str, default=None, help="Compare against the latest matching results in this file")
+parser.add_argument('--tolerance', type=float, default=.2, help="Flag regressions worse than this fraction")
+args = parser.parse_args()
+
+
+def random_action(env):
+    spec = env.actions
+    if env.hypers.single_action:
+        return np.random.uniform(spec['min_value'], spec['max_value'])
+    return dict(action=np.random.randint(3),
+                amount=np.random.uniform(spec['amount']['min_value'], spec['amount']['max_value']))
+
+
+def bench(flat, n_rows):
+    env = BitcoinEnv(flat, name='ppo_agent')
+    env.start_cash = env.start_value = 1000  # so random actions don't go broke every few steps
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    env.use_dataset(Mode.TRAIN)
+    use_dataset_s = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    n_steps, n_resets, reset_s, steps_s = 0, 0, 0., 0.
+    terminal = True
+    while n_steps < args.steps:
+        if terminal:
+            start = time.perf_counter()
+            env.reset()
+            reset_s += time.perf_counter() - start
+            n_resets += 1
+        action = random_action(env)
+        start = time.perf_counter()
+        _, terminal, _ = env.execute(action)
+        steps_s += time.perf_counter() - start
+        n_steps += 1
+    env.close()
+
+    return dict(
+        rows=n_rows,
+        cols=env.cols_,
+        use_dataset_s=use_dataset_s,
+        use_dataset_peak_mb=peak / 2**20,
+        reset_ms=reset_s / n_resets * 1000,
+        steps=n_steps,
+        steps_per_s=n_steps / steps_s,
+        maxrss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10  # whole process so far
+    )
+
+
+def main():
+    tables = synthetic.make_tables(args.tables)
+    out = []
+    for n_rows in args.sizes:
+        df = synthetic.random_walk(n_rows, tables)
+        synthetic.use_synthetic(df, tables)
+        for net_type in args.net_types:
+            hs = HSearchEnv(net_type=net_type)
+            flat, _, _ = hs.get_winner()
+            hs.close()
+            for scale, indicators, arbitrage in itertools.product(args.scale, args.indicators, args.arbitrage):
+                flat.update(scale=bool(scale), indicators=bool(indicators), arbitrage=bool(arbitrage))
+                btc_env.scalers.clear()  # fresh scaler per config, it fits as it goes
+                config = dict(net_type=net_type, scale=bool(scale), indicators=bool(indicators),
+                              arbitrage=bool(arbitrage))
+                res = results.stamp(dict(**config, **bench(flat, n_rows)))
+                print('\t'.join(f"{k}:{round(v, 2) if type(v) == float else v}" for k, v in res.items()
+                                if k not in ('commit', 'time')))
+                out.append(res)
+        del df
+
+    if args.baseline:
+        print('\n--- vs baseline ---')
+        results.compare(out, args.baseline, keys=['net_type', 'scale', 'indicators', 'arbitrage', 'rows'],
+                        metrics=dict(steps_per_s=True, use_dataset_s=False, use_dataset_peak_mb=False),
+                        tolerance=args.tolerance)
+    results.write(args.out, out)
+
+
+if __name__ == '__main__':
+    main()
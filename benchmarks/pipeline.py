@@ -0,0 +1,146 @@
+"""How the data pipeline scales w/ row-count and number of exchange tables, stage by stage: the SQL fetch
+(_db_to_dataframe_main's lateral-join query), F/B/Z imputation (data.impute), the float64 cast, _diff over the
+base columns (pct-change + quantile outlier-masking) and the full BitcoinEnv._xform_data (TA-Lib indicators + _diff +
+stacking). Each stage reports wall-time and peak traced memory; results go to a JSON-lines file tagged w/ the commit.
+
+Synthetic multi-exchange tick tables (random-walk candles w/ holes, secondary exchanges' timestamps jittered so the
+lateral join has work to do) are loaded into `--db`, a scratch Postgres (the fetch query uses LATERAL, so SQLite won't
+do). Tables are named `bench_exch{i}` and dropped afterwards unless --keep. Without --db the fetch stage is skipped and
+the synthetic frame goes straight into imputation.
+
+Eg `python -m benchmarks.pipeline --db postgres://localhost/bench --sizes 100000 1000000 --tables 1 2 5`
+"""
+
+import argparse, io, resource, time, tracemalloc
+
+from benchmarks import synthetic, results
+from data import data
+import features
+import btc_env
+from btc_env import BitcoinEnv
+from hypersearch import HSearchEnv
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--db', type=str, default=None, help="Scratch Postgres URL to load the synthetic tables into")
+parser.add_argument('--sizes', nargs='+', type=int, default=[100000, 1000000, 10000000], help="Rows per table")
+parser.add_argument('--tables', nargs='+', type=int, default=[1, 3, 5], help="Num exchange tables (joined)")
+parser.add_argument('--indicators', type=int, default=1, help="Include TA-Lib indicators in _xform_data (0/1)")
+parser.add_argument('--nan-frac', type=float, default=.01, help="Fraction of cells left NULL, for imputation to fill")
+parser.add_argument('--xform-procs', type=int, default=0, help="Parallel _xform_data (see btc_env.XFORM_PROCS)")
+parser.add_argument('--no-memory', action="store_true", default=False, help="Skip tracemalloc (it slows allocations, so timings are cleaner without)")
+parser.add_argument('--reuse', action="store_true", default=False, help="Tables from a prior --keep run are already loaded")
+parser.add_argument('--keep', action="store_true", default=False, help="Don't drop the bench tables afterwards")
+parser.add_argument('--out', type=str, default='bench_pipeline.jsonl')
+parser.add_argument('--baseline', type=str, default=None, help="Compare against the latest matching results in this file")
+parser.add_argument('--tolerance', type=float, default=.2)
+args = parser.parse_args()
+
+COPY_CHUNK = 1000000
+
+
+def load_tables(engine, tables, n_rows):
+    """Create & fill the bench tables (via COPY, in chunks) w/ `n_rows` synthetic rows each"""
+    import numpy as np
+    df = synthetic.random_walk(n_rows, tables, nan_frac=args.nan_frac)
+    conn = engine.raw_connection()
+    cur = conn.cursor()
+    for i, t in enumerate(tables):
+        name, cols = t['name'], list(t['cols'])
+        frame = df[[f"{name}_{c}" for c in cols]]
+        frame.columns = cols
+        # 1-min candles; secondary exchanges report a bit off the primary's clock
+        ts = 1500000000 + np.arange(n_rows) * 60
+        if i > 0: ts += np.random.randint(-30, 30, n_rows)
+        frame.insert(0, t['ts'], ts)
+        cur.execute(f"drop table if exists {name}")
+        cur.execute(f"create table {name} ({t['ts']} bigint, " + ', '.join(f"{c} double precision" for c in cols) + ")")
+        for start in range(0, n_rows, COPY_CHUNK):
+            buf = io.StringIO()
+            frame.iloc[start:start + COPY_CHUNK].to_csv(buf, header=False, index=False)
+            buf.seek(0)
+            cur.copy_expert(f"copy {name} from stdin with csv", buf)
+        cur.execute(f"create index on {name} ({t['ts']})")
+        cur.execute(f"analyze {name}")
+        conn.commit()
+        print(f"Loaded {n_rows} rows into {name}")
+    conn.close()
+
+
+def drop_tables(engine, tables):
+    conn = engine.connect()
+    for t in tables:
+        conn.execute(f"drop table if exists {t['name']}")
+    conn.close()
+
+
+def stage(name, fn, stats):
+    """Run fn(), recording its time (and peak memory) in stats"""
+    if not args.no_memory: tracemalloc.start()
+    start = time.perf_counter()
+    ret = fn()
+    stats[f'{name}_s'] = time.perf_counter() - start
+    if not args.no_memory:
+        stats[f'{name}_peak_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return ret
+
+
+def bench(env, n_rows, tables_, df=None):
+    stats = dict(rows=n_rows, tables=len(tables_), indicators=env.hypers.indicators, xform_procs=args.xform_procs)
+    if df is None:
+        df = stage('fetch', lambda: data._db_to_dataframe_main(env.conn, limit=n_rows, arbitrage=True, raw=True), stats)
+    df = stage('impute', lambda: data.impute(df, tables_), stats)
+    df = stage('astype', lambda: df.astype('float64', copy=False), stats)
+    cols = [f"{t['name']}_{c}" for t in tables_ for c in t['cols']]
+    stage('diff', lambda: env._diff(df[cols].values, env.hypers.pct_change), stats)
+    observations, prices = stage('xform', lambda: env._xform_data(df), stats)
+    stats['cols'] = observations.shape[1]
+    stats['maxrss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10  # whole process so far
+    return stats
+
+
+def main():
+    all_tables = synthetic.make_tables(max(args.tables), prefix='bench_exch')
+    data.target = f"{all_tables[0]['name']}_close"
+    data.engine = data.LazyEngine(args.db or 'sqlite://')
+    data.engine_runs = data.LazyEngine('sqlite://')  # HSearchEnv connects, not used
+    features.CACHE_DIR = features.SHM_DIR = None
+    btc_env.XFORM_PROCS = args.xform_procs
+    if args.db and not args.reuse:
+        load_tables(data.engine, all_tables, max(args.sizes))
+
+    hs = HSearchEnv(net_type='conv2d')
+    flat, _, _ = hs.get_winner()
+    hs.close()
+    flat.update(arbitrage=True, indicators=bool(args.indicators))
+
+    out = []
+    for n_rows in args.sizes:
+        frame = None if args.db else synthetic.random_walk(n_rows, all_tables, nan_frac=args.nan_frac)
+        for n_tables in args.tables:
+            data.tables = tables_ = all_tables[:n_tables]
+            env = BitcoinEnv(flat, name='ppo_agent')
+            df = None if frame is None else frame[[f"{t['name']}_{c}" for t in tables_ for c in t['cols']]].copy()
+            res = results.stamp(dict(db=bool(args.db), **bench(env, n_rows, tables_, df)))
+            print('\t'.join(f"{k}:{round(v, 2) if type(v) == float else v}" for k, v in res.items()
+                            if k not in ('commit', 'time')))
+            out.append(res)
+            env.close()
+            del df
+        del frame
+
+    if args.db and not args.keep:
+        drop_tables(data.engine, all_tables)
+
+    if args.baseline:
+        print('\n--- vs baseline ---')
+        stages = ['fetch', 'impute', 'astype', 'diff', 'xform']
+        metrics = {f'{s}_s': False for s in stages}
+        metrics.update({f'{s}_peak_mb': False for s in stages})
+        results.compare(out, args.baseline, keys=['db', 'rows', 'tables', 'indicators', 'xform_procs'], metrics=metrics,
+                        tolerance=args.tolerance)
+    results.write(args.out, out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Benchmark results are JSON lines, one per configuration, tagged w/ the commit they ran on. Append runs from
+different commits to the same file (or keep one per commit) and compare() them to catch regressions.
+"""
+
+import json, subprocess, time
+
+
+def commit():
+    try:
+        sha = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD']).decode().strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no']).strip()
+        return sha + ('-dirty' if dirty else '')
+    except Exception:
+        return None
+
+
+def write(path, results):
+    with open(path, 'a') as f:
+        for r in results:
+            f.write(json.dumps(r) + '\n')
+
+
+def stamp(result):
+    return dict(commit=commit(), time=time.time(), **result)
+
+
+def load(path):
+    return [json.loads(l) for l in open(path) if l.strip()]
+
+
+def compare(results, baseline_path, keys, metrics, tolerance=.2):
+    """Print each result's metrics relative to the latest baseline w/ the same `keys`. `metrics` is {name: higher_is_better}.
+    Returns the list of regressions (worse by more than `tolerance`)"""
+    baseline = {}
+    for r in load(baseline_path):
+        baseline[tuple(r.get(k) for k in keys)] = r  # latest wins
+    regressions = []
+    for r in results:
+        b = baseline.get(tuple(r[k] for k in keys))
+        if not b: continue
+        desc = ' '.join(f"{k}={r[k]}" for k in keys)
+        for m, higher_is_better in metrics.items():
+            if not b.get(m) or r.get(m) is None: continue
+            ratio = r[m] / b[m]
+            worse = ratio < 1 - tolerance if higher_is_better else ratio > 1 + tolerance
+            print(f"{desc}\t{m}: {round(b[m], 3)} -> {round(r[m], 3)} ({round(ratio, 2)}x){' REGRESSION' if worse else ''}")
+            if worse: regressions.append((desc, m, b[m], r[m]))
+    return regressions
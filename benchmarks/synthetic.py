@@ -0,0 +1,64 @@
+"""Synthetic price history for the benchmarks, shaped like the history DB's tables (see data.tables) so the env & data
+code-paths run unmodified on any size of data, no DB required. Same idea as test.py's monkeypatching, at scale.
+"""
+
+import numpy as np
+import pandas as pd
+from data import data
+from data.data import F, Z
+import features
+
+
+def make_tables(n_tables=2, prefix='exch'):
+    """`n_tables` exchanges in data.tables' format, each w/ the Kaggle-style OHLCV columns"""
+    return [dict(
+        name=f'{prefix}{i}',
+        ts='timestamp',
+        cols=dict(open=F, high=F, low=F, close=F, volume_btc=Z, volume_currency=Z, weighted_price=Z),
+        ohlcv=dict(open='open', high='high', low='low', close='close', volume='volume_currency')
+    ) for i in range(n_tables)]
+
+
+def random_walk(n_rows, tables, nan_frac=0., seed=0):
+    """DataFrame of `n_rows` 1-min candles per table, columns named like db_to_dataframe's (`{table}_{col}`). Each
+    exchange follows the first one's walk plus its own noise (so arbitrage features mean something). `nan_frac` of the
+    cells get blanked out, like the holes in the real data.
+    """
+    rng = np.random.RandomState(seed)
+    base = 10000 * np.exp(np.cumsum(rng.normal(0, .001, n_rows)))
+    columns = {}
+    for t in tables:
+        close = base * (1 + rng.normal(0, .0005, n_rows))
+        open_ = np.roll(close, 1)
+        open_[0] = close[0]
+        spread = np.abs(rng.normal(0, .0005, n_rows))
+        high = np.maximum(open_, close) * (1 + spread)
+        low = np.minimum(open_, close) * (1 - spread)
+        volume_btc = rng.lognormal(0, 1, n_rows)
+        cols = dict(open=open_, high=high, low=low, close=close, volume_btc=volume_btc,
+                    volume_currency=volume_btc * close, weighted_price=(high + low + close) / 3)
+        for k, v in cols.items():
+            if nan_frac:
+                v[rng.random_sample(n_rows) < nan_frac] = np.nan
+            columns[f"{t['name']}_{k}"] = v
+    return pd.DataFrame(columns)
+
+
+def use_synthetic(df, tables):
+    """Point data.py at `df` instead of the history DB (tables, target, count_rows, db_to_dataframe). Envs &
+    HSearchEnv still call engine.connect(), so those get an in-memory SQLite. The feature cache is off, it'd mix this
+    up w/ the real data (and we want to time the transforms)."""
+    data.tables = tables
+    data.target = f"{tables[0]['name']}_close"
+    data.count_rows = lambda conn, arbitrage=True: df.shape[0]
+
+    def db_to_dataframe(conn, limit='ALL', offset=0, arbitrage=True, **kwargs):
+        # offset=0 is most-recent, same as the real thing
+        cols = [f"{t['name']}_{c}" for t in data.get_tables(arbitrage) for c in t['cols']]
+        end = df.shape[0] - offset
+        start = 0 if limit == 'ALL' else max(0, end - limit)
+        return df.iloc[start:end][cols].copy()
+    data.db_to_dataframe = db_to_dataframe
+
+    data.engine = data.engine_runs = data.LazyEngine('sqlite://')
+    features.CACHE_DIR = features.SHM_DIR = None
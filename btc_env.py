@@ -10,19 +10,19 @@ I actually do want to try NervanaSystems/Coach, that one's new since I started d
 env back to Gym format. Anyone wanna give it a go?
 """
 
-import random, time, requests, pdb, gdax
+import os, glob, pickle, random, time, copy, shutil, pdb
 from enum import Enum
 import numpy as np
-import pandas as pd
-from talib.abstract import SMA, RSI, ATR, EMA
 from collections import Counter
-import tensorflow as tf
 from box import Box
 from tensorforce.environments import Environment
-from tensorforce.execution import Runner
-from sklearn.preprocessing import RobustScaler, robust_scale
 from data.data import Exchange, EXCHANGE
 from data import data
+import utils
+import features
+import indicators
+from exchange import AsyncExchange, parse_balances
+from metrics import Latency, Profiler
 
 
 class Mode(Enum):
@@ -50,6 +50,7 @@ class Scaler(object):
     STOP_AT = 3e5
     SKIP = 15
     def __init__(self):
+        from sklearn.preprocessing import RobustScaler
         self.reward_scaler = RobustScaler(quantile_range=(5., 95.))
         self.state_scaler = RobustScaler(quantile_range=(5., 95.))
         self.rewards = []
@@ -95,6 +96,132 @@ scalers = {}
 ALLOW_SEED = False
 TIMESTEPS = int(2e6)
 
+# Live-mode only keeps step_window + the selected indicators' longest lookback (indicators.py) + this slack for new
+# batches of rows around, see use_dataset()
+LIVE_SLACK = 100
+# Live-mode runs for weeks, so it only keeps this many recent signals (repeat-counting, episode_finished()'s stats) and
+# advantages/uniques (one per order) rather than one per tick forever
+LIVE_HISTORY = 10000
+
+# dtype of the observations matrix (the biggest thing we hold in RAM, rows x features). float32 is what the network
+# takes anyway. np.float16 halves it again, for packing more parallel trials on a box - values are clipped to its
+# range, and TensorFlow upcasts them to float32 when fed to the agent
+OBS_DTYPE = np.float32
+
+# Processes for computing features (per table, per indicator) in parallel, for datasets of at least
+# XFORM_PARALLEL_MIN rows. 0/1 = sequential. Mind the boxes running several hypersearch.py's already (--xform-procs)
+XFORM_PROCS = 0
+XFORM_PARALLEL_MIN = 100000
+
+
+def fold_window(n_rows, k, n_folds, split=.9, fidelity=1., test=False):
+    """Rows [start, end) of an n_rows history for walk-forward fold k of n_folds' train (or test) window. Test windows
+    are the n_folds most recent (1-split) slices, back to back, k=0 most recent. Each fold trains on the span right
+    before its test window - the same length for every fold, so the oldest fold's starts at the beginning of history.
+    Low fidelity trains on just the most recent slice of that span, same as w/o folds"""
+    n_test = round(n_rows * (1 - split))  # not int(), 1 - .9 is .0999..
+    n_train = n_rows - n_folds * n_test
+    assert n_train > n_test, f"Too many folds ({n_folds}) for a {round(1 - split, 2)} test split"
+    test_end = n_rows - k * n_test
+    test_start = test_end - n_test
+    if test: return test_start, test_end
+    return test_start - int(n_train * fidelity), test_start
+
+
+def _put(states, j, block):
+    """Write (float64) block into states' columns from j. NaN/inf -> 0/max, clipped to float16's range if that's
+    states' dtype. Done to the block in place first, cheaper than to the strided column-slice of states"""
+    np.nan_to_num(block, copy=False)
+    if states.dtype == np.float16:
+        fmax = np.finfo(np.float16).max
+        np.clip(block, -fmax, fmax, out=block)
+    states[:, j:j+block.shape[1]] = block
+
+
+def _xform_block(df, table, names, percent, outlier_window):
+    """One of _xform_data()'s tasks: a table's own columns (names=None) or its `names` indicators, diffed"""
+    name = table['name']
+    if names is None:
+        return features.diff(df[[f'{name}_{k}' for k in table['cols']]].values, percent, outlier_window)
+    # Extra indicator columns (see indicators.py). TA-Lib requires specifically-named inputs (OHLCV), a dict of
+    # the columns' arrays - no copy
+    ind = {k: df[f"{name}_{v}"].values for k, v in table['ohlcv'].items()}
+    return features.diff(indicators.compute(ind, names), percent, outlier_window)
+
+
+# (df, states, tasks, percent, outlier_window) in _xform_parallel()'s workers, see _xform_init()
+_xform_job = None
+
+
+def _xform_init(src, shape, columns, out, n_cols, dtype, tasks, percent, outlier_window):
+    """Worker start-up: wrap the shared input & output buffers (no copies)"""
+    global _xform_job
+    import pandas as pd
+    df = pd.DataFrame(np.frombuffer(src).reshape(shape), columns=columns, copy=False)
+    states = np.frombuffer(out, dtype=dtype).reshape(shape[0], n_cols)
+    _xform_job = (df, states, tasks, percent, outlier_window)
+
+
+def _xform_worker(i):
+    df, states, tasks, percent, outlier_window = _xform_job
+    table, names, j, w = tasks[i]
+    _put(states, j, _xform_block(df, table, names, percent, outlier_window))
+
+
+class AsyncTester(object):
+    """Runs train_and_test()'s test-rounds on a snapshot of the agent in a thread of its own, so training carries on
+    meanwhile. `eval_agent` is a second agent w/ the same spec (own graph & session), loaded w/ the training agent's
+    weights before each test (save_model -> restore_model); TF releases the GIL, so the two mostly overlap. One test in
+    flight at a time: submit() waits on the prior one & collects its results into env.acc.episode, so early-stop and
+    pruning see each round's result a round late.
+    """
+    def __init__(self, env, eval_agent):
+        import tempfile
+        from concurrent.futures import ThreadPoolExecutor
+        from tensorforce.execution import Runner
+        # Own env for the test data, so it doesn't swap datasets / step accumulators out from under training
+        self.env = env
+        self.eval_env = BitcoinEnv(env.hypers, name=env.agent_name)
+        self.eval_env.fold, self.eval_env.fidelity = env.fold, env.fidelity
+        self.runner = Runner(agent=eval_agent, environment=self.eval_env)
+        self.dir = tempfile.mkdtemp(prefix='tforce_btc_snap')
+        self.pool = ThreadPoolExecutor(1)
+        self.future = None
+
+    def _test(self):
+        start = time.time()
+        # Explicit directory: w/o one tensorforce joins `file` onto the agent's saver directory, which eval_agent
+        # doesn't have
+        self.runner.agent.restore_model(directory=self.dir, file='snapshot')
+        self.eval_env.use_dataset(Mode.TEST)
+        self.eval_env.run_deterministic(self.runner, print_results=True)
+        return time.time() - start
+
+    def collect(self):
+        if not self.future: return
+        with self.env.profiler.span('test_wait'):  # how long training actually blocked on testing
+            seconds = self.future.result()
+        self.future = None
+        self.env.profiler.add('test', seconds)
+        src, dst = self.eval_env.acc.episode, self.env.acc.episode
+        dst.advantages.append(src.advantages[-1])
+        dst.uniques.append(src.uniques[-1])
+
+    def submit(self, agent):
+        self.collect()
+        agent.save_model(directory=f'{self.dir}/snapshot', append_timestep=False)
+        # Scaler's still fitting as it goes, snapshot that too rather than share it across threads
+        self.eval_env.scaler = copy.deepcopy(self.env.scaler)
+        self.future = self.pool.submit(self._test)
+
+    def close(self):
+        try:
+            self.collect()
+        finally:
+            self.pool.shutdown()
+            self.eval_env.close()
+            shutil.rmtree(self.dir, ignore_errors=True)
+
 
 class BitcoinEnv(Environment):
     def __init__(self, hypers, name='ppo_agent'):
@@ -115,20 +242,28 @@ class BitcoinEnv(Environment):
                 i=0,
                 total_steps=0,
                 advantages=[],
-                uniques=[]
+                uniques=[],
+                pruned=False
             ),
             step=dict(i=0)  # setup in reset()
         )
         self.mode = Mode.TRAIN
+        # Fraction of the full budget (TIMESTEPS & training-span) this env trains with; see train_and_test()
+        self.fidelity = 1.
+        # Walk-forward fold (k, n_folds) to train & test on, None for the usual 90/10 split. See fold_window()
+        self.fold = None
         self.conn = data.engine.connect()
+        # Live-mode's data source (data.LiveFeed, or data.ReplayFeed to replay history through the live path) and
+        # per-tick latency spans
+        self.feed = None
+        self.latency = Latency()
+        # Per-stage timings for a whole training run / trial (opt-in, see metrics.Profiler)
+        self.profiler = Profiler()
 
         # TODO this might need to be placed somewhere that updates relatively often
         # gdax min order size = .01btc; krakken = .002btc
         self.min_trade = {Exchange.GDAX: .01, Exchange.KRAKEN: .002}[EXCHANGE]
-        try:
-            self.btc_price = int(requests.get(f"https://api.cryptowat.ch/markets/{EXCHANGE.value}/btcusd/price").json()['result']['price'])
-        except:
-            self.btc_price = 12000
+        self.btc_price = data.btc_price(self.conn)
 
         # Action space
         trade_cap = self.min_trade * 2  # not necessary to limit it like this, doing for my own sanity in live-mode
@@ -142,7 +277,8 @@ class BitcoinEnv(Environment):
                 amount=dict(type='float', shape=(), min_value=self.min_trade, max_value=trade_cap))
 
         # Observation space
-        self.cols_ = data.n_cols(indicators=self.hypers.indicators, arbitrage=self.hypers.arbitrage)
+        self.indicators = indicators.selected(self.hypers)
+        self.cols_ = data.n_cols(indicators=self.indicators, arbitrage=self.hypers.arbitrage)
         self.states_ = dict(
             series=dict(type='float', shape=self.cols_),  # all state values that are time-ish
             stationary=dict(type='float', shape=3)  # everything that doesn't care about time (cash, value, n_repeats)
@@ -154,14 +290,17 @@ class BitcoinEnv(Environment):
             # channels = features/inputs (price actions, OHCLV, etc).
             self.states_['series']['shape'] = (self.hypers.step_window, 1, self.cols_)
 
-        scaler_k = f'ind={self.hypers.indicators}arb={self.hypers.arbitrage}'
-        if scaler_k not in scalers:
-            scalers[scaler_k] = Scaler()
-        self.scaler = scalers[scaler_k]
+        self.scaler_k = f'ind={",".join(self.indicators)}arb={self.hypers.arbitrage}'
+        if self.scaler_k not in scalers:
+            scalers[self.scaler_k] = Scaler()
+        self.scaler = scalers[self.scaler_k]
 
     def __str__(self): return 'BitcoinEnv'
 
-    def close(self): self.conn.close()
+    def close(self):
+        self.conn.close()
+        if self.feed: self.feed.close()
+        if getattr(self, 'exchange', None): self.exchange.close()
 
     @property
     def states(self): return self.states_
@@ -175,54 +314,112 @@ class BitcoinEnv(Environment):
         # return [seed]
         random.seed(seed)
         np.random.seed(seed)
+        import tensorflow as tf
         tf.set_random_seed(seed)
 
-    def _diff(self, arr, percent=False):
-        series = pd.Series(arr)
-        diff = series.pct_change() if percent else series.diff()
-        diff.iloc[0] = 0  # always NaN, nothing to compare to
-
-        # Remove outliers (turn them to NaN)
-        q = diff.quantile(0.99)
-        diff = diff.mask(diff > q, np.nan)
+    def _outlier_window(self):
+        """Outliers are judged over a trailing window (causal) w/ hypers.rolling_outliers - and always for walk-forward
+        folds: they slice one full-history matrix, where a global threshold would have older folds' features depend
+        on later folds' test data"""
+        return features.OUTLIER_WINDOW if self.hypers.get('rolling_outliers') or self.fold else None
 
-        # then forward-fill the NaNs.
-        return diff.replace([np.inf, -np.inf], np.nan).ffill().bfill().values
+    def _diff(self, arr, percent=False):
+        """Change over time of each column, outliers removed (see features.diff)"""
+        return features.diff(arr, percent, outlier_window=self._outlier_window())
+
+    def _xform_tasks(self, split=False):
+        """How _xform_data() splits up the work: [(table, indicator names (None for the table's own columns), column
+        offset, width)], plus the total width. `split` gives each indicator a task of its own (for parallel)"""
+        tasks, j = [], 0
+        for table in data.get_tables(self.hypers.arbitrage):
+            w = len(table['cols'])
+            tasks.append((table, None, j, w))
+            j += w
+            if table.get('ohlcv') and self.indicators:
+                for names in ([[n] for n in self.indicators] if split else [self.indicators]):
+                    w = indicators.width(names)
+                    tasks.append((table, names, j, w))
+                    j += w
+        return tasks, j
+
+    def _xform_block(self, df, table, names):
+        return _xform_block(df, table, names, self.hypers.pct_change, self._outlier_window())
 
     def _xform_data(self, df):
-        columns = []
-        tables_ = data.get_tables(self.hypers.arbitrage)
-        percent = self.hypers.pct_change
-        for table in tables_:
-            name, cols, ohlcv = table['name'], table['cols'], table.get('ohlcv', {})
-            columns += [self._diff(df[f'{name}_{k}'], percent) for k in cols]
-
-            # Add extra indicator columns
-            if ohlcv and self.hypers.indicators:
-                ind = pd.DataFrame()
-                # TA-Lib requires specifically-named columns (OHLCV)
-                for k, v in ohlcv.items():
-                    ind[k] = df[f"{name}_{v}"]
-                columns += [
-                    ## Original indicators from some boilerplate repo I started with
-                    self._diff(SMA(ind, timeperiod=15), percent),
-                    self._diff(SMA(ind, timeperiod=60), percent),
-                    self._diff(RSI(ind, timeperiod=14), percent),
-                    self._diff(ATR(ind, timeperiod=14), percent),
-
-                    ## Indicators from the book "How to Day Trade For a Living". Not sure which are more solid...
-                    ## Price, Volume, 9-EMA, 20-EMA, 50-SMA, 200-SMA, VWAP, prior-day-close
-                    # self._diff(EMA(ind, timeperiod=9)),
-                    # self._diff(EMA(ind, timeperiod=20)),
-                    # self._diff(SMA(ind, timeperiod=50)),
-                    # self._diff(SMA(ind, timeperiod=200)),
-                ]
-
-        states = np.nan_to_num(np.column_stack(columns))
-        prices = df[data.target].values
+        """df -> (observations, prices). Each feature is written straight into a preallocated OBS_DTYPE matrix, so
+        there's no list-of-columns + column_stack + nan_to_num copies of it along the way. Prices are copied out (rather
+        than a view into df) so the caller can drop df right after. Big datasets are done in parallel if XFORM_PROCS.
+        """
+        n_cols = data.n_cols(self.indicators, self.hypers.arbitrage)
+        if XFORM_PROCS > 1 and df.shape[0] >= XFORM_PARALLEL_MIN:
+            states = self._xform_parallel(df, n_cols)
+        else:
+            tasks, width = self._xform_tasks()
+            assert width == n_cols, "data.n_cols() out of sync w/ _xform_data()"
+            states = np.empty((df.shape[0], n_cols), dtype=OBS_DTYPE)
+            for table, names, j, w in tasks:
+                _put(states, j, self._xform_block(df, table, names))
+
+        prices = np.array(df[data.target], dtype=np.float64)
         # Note: don't scale/normalize here, since we'll normalize w/ self.price/step_acc.cash after each action
         return states, prices
 
+    def _xform_parallel(self, df, n_cols):
+        """Fans _xform_data()'s tasks (per table, per indicator) out to a process pool, which reads df from & writes
+        its columns straight into shared-memory buffers. Spawned rather than forked: by now the TF agent's usually
+        been built, and a fork of a process running TF's threads can deadlock. Costs one copy of df (into the shared
+        input buffer) and the workers' start-up"""
+        import multiprocessing as mp
+        tasks, width = self._xform_tasks(split=True)
+        assert width == n_cols, "data.n_cols() out of sync w/ _xform_data()"
+        src = mp.RawArray('d', df.shape[0] * df.shape[1])
+        np.frombuffer(src).reshape(df.shape)[:] = df.values
+        out = mp.RawArray('b', df.shape[0] * n_cols * np.dtype(OBS_DTYPE).itemsize)
+        initargs = (src, df.shape, list(df.columns), out, n_cols, np.dtype(OBS_DTYPE).name, tasks,
+                    self.hypers.pct_change, self._outlier_window())
+        with mp.get_context('spawn').Pool(min(XFORM_PROCS, len(tasks)), initializer=_xform_init,
+                                          initargs=initargs) as pool:
+            pool.map(_xform_worker, range(len(tasks)), chunksize=1)
+        return np.frombuffer(out, dtype=OBS_DTYPE).reshape(df.shape[0], n_cols)
+
+    def _transform(self, df):
+        self.profiler.count('rows_loaded', df.shape[0])
+        self.observations = self.prices = self.prices_diff = None
+        with self.profiler.span('features'):
+            self.observations, self.prices = self._xform_data(df)
+            self.prices_diff = self._diff(self.prices, percent=True)
+
+    def _cache_key(self, limit, offset):
+        """Everything the transformed dataset depends on. Rows are identified by row-count & limit/offset, which
+        assumes the history DB is append-only (offset=0 is most-recent, so new rows shift every slice)"""
+        return features.cache_key(
+            version=features.VERSION, db=data.DB, tables=data.get_tables(self.hypers.arbitrage), target=data.target,
+            row_ct=self.row_ct, limit=limit, offset=offset, indicators=self.indicators,
+            pct_change=self.hypers.pct_change, rolling_outliers=self._outlier_window() is not None,
+            dtype=np.dtype(OBS_DTYPE).name)
+
+    def _load_cached(self, limit, offset):
+        """(observations, prices, prices_diff) for this slice of history, from the feature cache or else built (and
+        cached). Cached ones are read-only, shared w/ every process on the box using this dataset (see features.py)"""
+        cache_key = self._cache_key(limit, offset)
+        with self.profiler.span('cache'):
+            cached = features.cache_load(cache_key)
+        if cached:
+            self.profiler.count('cache_hits')
+            return cached
+        # One process on the box builds a given dataset, any others wanting it wait here & then map its copy
+        with features.cache_lock(cache_key):
+            cached = features.cache_load(cache_key)
+            if cached: return cached
+            with self.profiler.span('load'):
+                df = data.db_to_dataframe(self.conn, limit=limit, offset=offset, arbitrage=self.hypers.arbitrage)
+            self._transform(df)
+            del df
+            if features.cache_save(cache_key, self.observations, self.prices, self.prices_diff):
+                # Swap ours for the shared copy
+                return features.cache_load(cache_key) or (self.observations, self.prices, self.prices_diff)
+            return self.observations, self.prices, self.prices_diff
+
     def _reshape_window_for_conv2d(self, window):
         return np.expand_dims(window, axis=1)
 
@@ -237,20 +434,40 @@ class BitcoinEnv(Environment):
             self.conn = data.engine_live.connect()
             # Work with 6000 timesteps up until the present (play w/ diff numbers, depends on LSTM)
             # Offset=0 data.py currently pulls recent-to-oldest, then reverses
-            limit, offset = (6000, 0) # if not self.conv2d else (self.hypers.step_window + 1, 0)
-            df, self.last_timestamp = data.db_to_dataframe(
-                self.conn, limit=limit, offset=offset, arbitrage=self.hypers.arbitrage, last_timestamp=True)
-            # save away for now so we can keep transforming it as we add new data (find a more efficient way)
+            limit = 6000 # if not self.conv2d else self.hypers.step_window + 1
+            if not self.feed:
+                self.feed = data.LiveFeed(data.engine_live)
+            with self.profiler.span('load'):
+                df, self.last_timestamp = self.feed.fetch_initial(self.conn, limit=limit, arbitrage=self.hypers.arbitrage)
+            # Save away so we can keep transforming it as we add new data. The initial 6000 are for warming up (LSTM);
+            # after that we only keep what the transforms & window need, so a weeks-long live process stays at constant
+            # memory & per-tick cost
             self.df = df
+            capacity = (self.hypers.step_window if self.conv2d else 1) + indicators.lookback(self.indicators) + \
+                       LIVE_SLACK
+            if self.hypers.get('rolling_outliers'):
+                capacity += features.OUTLIER_WINDOW  # so outliers are judged over the same window as in training
+            self.window = utils.RingBuffer(capacity, df.shape[1])
+            self.window.extend(df.values)
         else:
             self.row_ct = data.count_rows(self.conn, arbitrage=self.hypers.arbitrage)
             split = .9  # Using 90% training data.
+            # Drop the prior dataset first, else we briefly hold both
+            self.observations = self.prices = self.prices_diff = None
+            if self.fold:
+                # Every fold's windows are slices (views, no copies) of the one full-history matrix
+                full = self._load_cached(limit=self.row_ct, offset=0)
+                k, n_folds = self.fold
+                start, end = fold_window(len(full[0]), k, n_folds, split, self.fidelity, test=mode == Mode.TEST)
+                self.observations, self.prices, self.prices_diff = [a[start:end] for a in full]
+                return
             n_train, n_test = int(self.row_ct * split), int(self.row_ct * (1 - split))
-            limit, offset = (n_test, n_train) if mode == mode.TEST else (n_train, 0)
-            df = data.db_to_dataframe(self.conn, limit=limit, offset=offset, arbitrage=self.hypers.arbitrage)
+            # Low-fidelity trains on just the most recent slice of the training data (offset=0 is most-recent)
+            limit, offset = (n_test, n_train) if mode == mode.TEST else (int(n_train * self.fidelity), 0)
+            self.observations, self.prices, self.prices_diff = self._load_cached(limit, offset)
+            return
 
-        self.observations, self.prices = self._xform_data(df)
-        self.prices_diff = self._diff(self.prices, percent=True)
+        self._transform(df)
         after_time = round(time.time() - before_time)
         # print(f"Loading {mode.name} took {after_time}s")
 
@@ -338,8 +555,9 @@ class BitcoinEnv(Environment):
 
         next_state = self.observations[step_acc.i]
         if self.hypers.scale:
-            next_state = self.scaler.transform_state(next_state)
-            reward = self.scaler.transform_reward(reward)
+            with self.latency.span('scale'), self.profiler.span('scale'):
+                next_state = self.scaler.transform_state(next_state)
+                reward = self.scaler.transform_reward(reward)
         if self.conv2d:
             window = self.observations[step_acc.i - self.hypers.step_window:step_acc.i]
             next_state = self._reshape_window_for_conv2d(window)
@@ -356,40 +574,52 @@ class BitcoinEnv(Environment):
         if terminal and self.mode in (Mode.LIVE, Mode.TEST_LIVE):
             # Only do real buy/sell on last step if LIVE (in case there are multiple steps b/w, we only care about
             # present). Then we unset terminal, after we fetch some new data (keep going)
-            # GDAX https://github.com/danpaquin/gdax-python
+            # GDAX https://github.com/danpaquin/gdax-python. Orders & balance-checks go out on a background thread (see
+            # exchange.py), we carry on with last-known balances
             live = self.mode == Mode.LIVE
-            if signal < 0:
-                if live:
-                    self.gdax_client.sell(
-                        # price=str(abs_sig),  # USD
-                        size=float(abs_sig),  # BTC
-                        product_id='BTC-USD')
-                print(f"Sold {signal}!")
-            elif signal > 0:
-                if live:
-                    self.gdax_client.buy(
-                        # price=str(abs_sig),  # USD
-                        size=float(abs_sig),  # BTC
-                        product_id='BTC-USD')
-                print(f"Bought {signal}!")
-            elif step_acc.i % 10 == 0:
-                print(".")
-
+            # Just handing it to AsyncExchange; its round-trip to the exchange is `order_rtt` (see exchange.py)
+            with self.latency.span('order_submit'):
+                if signal < 0:
+                    if live: self.exchange.sell(abs_sig)  # BTC
+                    print(f"Sold {signal}!")
+                elif signal > 0:
+                    if live: self.exchange.buy(abs_sig)  # BTC
+                    print(f"Bought {signal}!")
+                elif step_acc.i % 10 == 0:
+                    print(".")
+                if live: self.exchange.refresh()  # after the order, so it's reflected by the time we reconcile
+            if getattr(self, 'tick_start', None):
+                # From waking to new rows till the decision they led to is handed off to the exchange
+                self.latency.record('tick_to_order', time.perf_counter() - self.tick_start)
+            self.latency.maybe_emit()
+
+            import pandas as pd  # only the live loop needs it
             new_data = None
             while new_data is None:
-                new_data, n_new, new_timestamp = data.fetch_more(
-                    conn=self.conn, last_timestamp=self.last_timestamp, arbitrage=self.hypers.arbitrage)
-                time.sleep(20)
+                # The tick starts once we're woken (or straight away, if rows were already waiting): fetch, features,
+                # act & order all count toward tick_to_order. The DB insert -> notify hop before that isn't measurable
+                # from here (different clocks)
+                self.tick_start = time.perf_counter()
+                with self.latency.span('fetch'):
+                    new_data, n_new, new_timestamp = self.feed.fetch_more(
+                        self.conn, last_timestamp=self.last_timestamp, arbitrage=self.hypers.arbitrage)
+                if new_data is None:
+                    with self.latency.span('wait'):
+                        self.feed.wait()  # till the live DB notifies of new rows (or times out)
             self.last_timestamp = new_timestamp
-            self.df = pd.concat([self.df, new_data], axis=0)
-            self.observations, self.prices = self._xform_data(self.df)
-            self.prices_diff = self._diff(self.prices, percent=True)
-            step_acc.i = self.df.shape[0] - n_new - 1
+            with self.latency.span('features'):
+                self.window.extend(new_data[self.df.columns].values)
+                self.df = pd.DataFrame(self.window.view(), columns=self.df.columns)
+                self.observations, self.prices = self._xform_data(self.df)
+                self.prices_diff = self._diff(self.prices, percent=True)
+            start_timestep = self.hypers.step_window if self.conv2d else 1
+            step_acc.i = max(self.df.shape[0] - n_new - 1, start_timestep)
+            if len(step_acc.signals) > 2 * LIVE_HISTORY:
+                del step_acc.signals[:-LIVE_HISTORY]  # in batches, so it's amortized
 
             if live:
-                accounts = self.gdax_client.get_accounts()
-                step_acc.cash = float([a for a in accounts if a['currency'] == 'USD'][0]['balance']) / self.btc_price
-                step_acc.value = float([a for a in accounts if a['currency'] == 'BTC'][0]['balance'])
+                usd, btc = self.exchange.reconcile()
+                step_acc.cash, step_acc.value = usd / self.btc_price, btc
             if signal != 0:
                 print(f"New Total: {step_acc.cash + step_acc.value}")
                 self.episode_finished(None)  # Fixme refactor, awkward function to call here
@@ -413,6 +643,8 @@ class BitcoinEnv(Environment):
         self.acc.episode.advantages.append(advantage)
         n_uniques = float(len(np.unique(signals)))
         self.acc.episode.uniques.append(n_uniques)
+        if self.mode in (Mode.LIVE, Mode.TEST_LIVE):
+            del ep_acc.advantages[:-LIVE_HISTORY], ep_acc.uniques[:-LIVE_HISTORY]
 
         # Print (limit to note-worthy)
         common = dict((round(k,2), v) for k, v in Counter(signals).most_common(5))
@@ -421,42 +653,133 @@ class BitcoinEnv(Environment):
         return True
 
     def run_deterministic(self, runner, print_results=True):
-        next_state, terminal = self.reset(), False
-        while not terminal:
-            next_state, terminal, reward = self.execute(runner.agent.act(next_state, deterministic=True))
+        with self.profiler.span('test'):
+            next_state, terminal = self.reset(), False
+            while not terminal:
+                with self.latency.span('act'):
+                    actions = runner.agent.act(next_state, deterministic=True)
+                next_state, terminal, reward = self.execute(actions)
         if print_results: self.episode_finished(None)
 
-    def train_and_test(self, agent, early_stop=-1, n_tests=40):
-        n_train = TIMESTEPS // n_tests
+    def _test_round(self, runner, tester):
+        if tester:
+            tester.submit(runner.agent)
+        else:
+            self.use_dataset(Mode.TEST)
+            self.run_deterministic(runner, print_results=True)
+
+    def _checkpoint(self, path, agent, i, pending):
+        """Save what train_and_test() needs to carry on after test-round i: agent weights, episode accumulators
+        (advantages, uniques, ...), scaler. `pending`: round i's test was still running (AsyncTester), so isn't in
+        the accumulators yet"""
+        os.makedirs(path, exist_ok=True)
+        agent.save_model(directory=f'{path}/round{i}', append_timestep=False)
+        state = dict(i=i, pending=pending, model=f'round{i}', episode=dict(self.acc.episode), scaler=self.scaler)
+        with open(f'{path}/state.pkl.tmp', 'wb') as f:
+            pickle.dump(state, f)
+        os.rename(f'{path}/state.pkl.tmp', f'{path}/state.pkl')  # state.pkl always points at a complete save
+        for f in glob.glob(f'{path}/round*'):
+            if not f.startswith(f'{path}/round{i}.'): os.remove(f)
+
+    def _resume(self, path, agent):
+        """Restore agent & env from path's checkpoint (see _checkpoint()) -> (round, pending), or None if none"""
+        try:
+            with open(f'{path}/state.pkl', 'rb') as f:
+                state = pickle.load(f)
+        except IOError:
+            return None
+        agent.restore_model(directory=path, file=state['model'])  # not just file, see AsyncTester._test()
+        self.acc.episode.update(state['episode'])
+        self.scaler = scalers[self.scaler_k] = state['scaler']
+        print(f"Resuming after test-round {state['i']}")
+        return state['i'], state['pending']
+
+    def train_and_test(self, agent, early_stop=-1, n_tests=40, pruner=None, fidelity=1., eval_agent=None,
+                       checkpoint=None):
+        """
+        :param pruner: optional fn(advantages) -> bool (see utils.make_pruner). Checked after each test-round; if it
+            says so, we abort the trial (flagged via acc.episode.pruned) rather than spend the rest of TIMESTEPS on it
+        :param fidelity: (0, 1], fraction of the full budget to spend. Scales TIMESTEPS, the number of test-rounds
+            (so each round trains the same n_train steps) and the training span. Used by hypersearch's Hyperband mode
+            to cheaply screen combos before promoting the best to full fidelity.
+        :param eval_agent: optional second agent (same spec as `agent`) to run test-rounds on concurrently w/ training,
+            see AsyncTester. The final no-kill test still runs on `agent` once training's done
+        :param checkpoint: optional directory to checkpoint to after every test-round. If it holds one already (the
+            process died partway), we pick up from there instead of starting over. Caller cleans it up when done
+        """
+        self.fidelity = fidelity
+        from tensorforce.execution import Runner
+        n_tests = max(1, round(n_tests * fidelity))
+        n_train = int(TIMESTEPS * fidelity) // n_tests
         i = 0
+        if self.profiler.enabled:
+            # The Runner calls these directly, time them from the outside. `observe` is where the agent updates
+            agent.act = self.profiler.wrap('act', agent.act)
+            agent.observe = self.profiler.wrap('observe', agent.observe)
+            self.execute = self.profiler.wrap('execute', self.execute)
+            self.reset = self.profiler.wrap('reset', self.reset)
         runner = Runner(agent=agent, environment=self)
+        tester = AsyncTester(self, eval_agent) if eval_agent else None
 
-        while i <= n_tests:
-            self.use_dataset(Mode.TRAIN)
-            runner.run(timesteps=n_train, max_episode_timesteps=n_train)
-            self.use_dataset(Mode.TEST)
-            self.run_deterministic(runner, print_results=True)
-            if early_stop > 0:
-                advantages = np.array(self.acc.episode.advantages[-early_stop:])
-                if i >= early_stop and np.all(advantages > 0):
-                    i = n_tests
-            i += 1
+        try:
+            resumed = self._resume(checkpoint, agent) if checkpoint else None
+            if resumed:
+                i, pending = resumed
+                if pending: self._test_round(runner, tester)  # its result never made it back
+                i += 1
+            while i <= n_tests:
+                self.use_dataset(Mode.TRAIN)
+                with self.profiler.span('train'):
+                    runner.run(timesteps=n_train, max_episode_timesteps=n_train)
+                self._test_round(runner, tester)
+                if early_stop > 0:
+                    advantages = np.array(self.acc.episode.advantages[-early_stop:])
+                    if i >= early_stop and np.all(advantages > 0):
+                        i = n_tests
+                if pruner and pruner(self.acc.episode.advantages):
+                    print(f"Pruned after {i+1} test-runs, trailing past runs")
+                    self.acc.episode.pruned = True
+                    if tester:
+                        # The tests ran on the tester's env, this one's still holding TRAIN data. Hand back the last
+                        # test's prices & signals, same as w/o async
+                        tester.collect()
+                        self.prices, self.acc.step.signals = tester.eval_env.prices, tester.eval_env.acc.step.signals
+                    return
+                if checkpoint:
+                    with self.profiler.span('checkpoint'):
+                        self._checkpoint(checkpoint, agent, i, pending=bool(tester))
+                i += 1
+        finally:
+            if tester: tester.close()
 
         # On last "how would it have done IRL?" run, without getting in the way (no killing on repeats, 0-balance)
         self.use_dataset(Mode.TEST, no_kill=True)
         self.run_deterministic(runner, print_results=True)
 
-    def run_live(self, agent, test=True):
-        gdax_conf = data.config_json['GDAX']
-        self.gdax_client = gdax.AuthenticatedClient(gdax_conf['key'], gdax_conf['b64secret'], gdax_conf['passphrase'])
-        # self.gdax_client = gdax.AuthenticatedClient(gdax_conf['key'], gdax_conf['b64secret'], gdax_conf['passphrase'],
-        #                                        api_url="https://api-public.sandbox.gdax.com")
-
-        accounts = self.gdax_client.get_accounts()
-        self.start_cash = float([a for a in accounts if a['currency'] == 'USD'][0]['balance']) / self.btc_price
-        self.start_value = float([a for a in accounts if a['currency'] == 'BTC'][0]['balance'])
+    def run_live(self, agent, test=True, client=None):
+        """
+        :param client: exchange client to trade against, default a gdax.AuthenticatedClient from config.json. Pass an
+            exchange.SimExchange (w/ test=False) to run the full live loop offline
+        """
+        if client is None:
+            import gdax
+            gdax_conf = data.config_json['GDAX']
+            client = gdax.AuthenticatedClient(gdax_conf['key'], gdax_conf['b64secret'], gdax_conf['passphrase'])
+            # client = gdax.AuthenticatedClient(gdax_conf['key'], gdax_conf['b64secret'], gdax_conf['passphrase'],
+            #                                   api_url="https://api-public.sandbox.gdax.com")
+        self.exchange = AsyncExchange(client, latency=self.latency)
+        if not isinstance(self.feed, data.ReplayFeed):
+            # Converting real balances, so we want the current price (from the live DB) rather than a cached one
+            conn_live = data.engine_live.connect()
+            self.btc_price = data.btc_price(conn_live, max_age=0)
+            conn_live.close()
+
+        # Starting balances we do wait on, nothing to go on otherwise
+        usd, btc = self.exchange.balances = parse_balances(client.get_accounts())
+        self.start_cash, self.start_value = usd / self.btc_price, btc
         print(f'Starting total: {self.start_cash + self.start_value}')
 
+        from tensorforce.execution import Runner
         runner = Runner(agent=agent, environment=self)
         self.use_dataset(Mode.TEST_LIVE if test else Mode.LIVE, no_kill=True)
         self.run_deterministic(runner, print_results=True)
@@ -1,17 +1,32 @@
-import time, json, re
+import time, json, re, zlib, hashlib, select
 from enum import Enum
-import pandas as pd
-from sqlalchemy import create_engine
+import numpy as np
 from sqlalchemy import text
 import os
 
+
+class LazyEngine(object):
+    """Creates the SQLAlchemy engine (and loads its DB driver) on first use, so importing this module - eg from the
+    dashboard, or a spawned worker which only needs one of the DBs - doesn't set up all three up-front.
+    """
+    def __init__(self, url):
+        self.url = url
+        self.engine = None
+
+    def __getattr__(self, k):
+        if self.engine is None:
+            from sqlalchemy import create_engine
+            self.engine = create_engine(self.url)
+        return getattr(self.engine, k)
+
+
 # From connecting source file, `import engine` and run `engine.connect()`. Need each connection to be separate
 # (see https://stackoverflow.com/questions/3724900/python-ssl-problem-with-multiprocessing)
 config_json = json.load(open(os.path.dirname(__file__) + '/../config.json'))
 DB = config_json['DB_HISTORY'].split('/')[-1]
-engine = create_engine(config_json['DB_HISTORY'])
-engine_live = create_engine(config_json['DB_HISTORY_LIVE'])
-engine_runs = create_engine(config_json['DB_RUNS'])
+engine = LazyEngine(config_json['DB_HISTORY'])
+engine_live = LazyEngine(config_json['DB_HISTORY_LIVE'])
+engine_runs = LazyEngine(config_json['DB_RUNS'])
 
 
 
@@ -78,17 +93,64 @@ else:
     target = 'coinbase_close'
 
 
+# BTC price (USD) is used to convert USD balances to BTC. See btc_price()
+PRICE_CACHE = os.path.dirname(__file__) + '/../.btc_price.json'
+PRICE_TTL = 60 * 60
+PRICE_FALLBACK = 12000
+
+
+def btc_price(conn=None, max_age=PRICE_TTL, timeout=2.):
+    """Latest BTC price, without ever hanging env construction (this gets called for every hypersearch trial, often on
+    offline workers). Tries in order: on-disk cache if younger than `max_age` seconds; the latest target price in
+    `conn`'s database; CryptoWatch's API w/ a strict `timeout`; the cache however old; PRICE_FALLBACK.
+    """
+    try:
+        cached = json.load(open(PRICE_CACHE))
+    except (IOError, ValueError):
+        cached = None
+    if cached and time.time() - cached['time'] < max_age:
+        return cached['price']
+
+    price = None
+    if conn is not None:
+        t = tables[0]
+        col = target[len(t['name']) + 1:]
+        try:
+            row = conn.execute(f"select {col} from {t['name']} where {col} is not null order by {t['ts']} desc limit 1").fetchone()
+            price = row and row[0]
+        except Exception as e:
+            print(f"btc_price: DB lookup failed ({e})")
+    if not price:
+        try:
+            import requests
+            url = f"https://api.cryptowat.ch/markets/{EXCHANGE.value}/btcusd/price"
+            price = requests.get(url, timeout=timeout).json()['result']['price']
+        except Exception:
+            pass
+    if not price:
+        return cached['price'] if cached else PRICE_FALLBACK
+
+    price = int(price)
+    try:
+        json.dump(dict(price=price, time=time.time()), open(PRICE_CACHE, 'w'))
+    except IOError:
+        pass
+    return price
+
+
 def get_tables(arbitrage=True):
     return tables if arbitrage else [tables[0]]
 
 
-def n_cols(indicators=False, arbitrage=True):
+def n_cols(indicators=(), arbitrage=True):
+    """:param indicators: indicator names (see indicators.selected()), computed for each table w/ OHLCV"""
+    from indicators import width
     cols = 0
     tables_ = get_tables(arbitrage)
     for t in tables_:
         cols += len(t['cols'])
-        if indicators and 'ohlcv' in t:
-            cols += 4  # This is defined in btc_env._get_indicators()
+        if 'ohlcv' in t:
+            cols += width(indicators)
     # Extra 3 cols (self.cash, self.value, self.repeats) are added in downstream dense
     return cols
 
@@ -135,10 +197,22 @@ def _db_to_dataframe_ohlc(conn, limit='ALL', offset=0, just_count=False, arbitra
     if just_count:
         return conn.execute(query).fetchone()[0]
 
+    import pandas as pd
     return pd.read_sql_query(query, conn).iloc[::-1].ffill()
 
 
-def _db_to_dataframe_main(conn, limit='ALL', offset=0, just_count=False, arbitrage=True, last_timestamp=False):
+def impute(df, tables_):
+    """Fill NaNs per the F/B/Z rules of each table's cols"""
+    for t in tables_:
+        for k, method in t['cols'].items():
+            fill = {'value': 0} if method == Z else {'method': 'ffill' if method == F else 'bfill'}
+            col_name = f"{t['name']}_{k}"
+            df[col_name] = df[col_name].fillna(fill)
+    return df
+
+
+def _db_to_dataframe_main(conn, limit='ALL', offset=0, just_count=False, arbitrage=True, last_timestamp=False,
+                          since=None, raw=False):
     """
     Fetches data from your `history` database. During training, this'll fetch 80% of the data (TODO: buffer that
     instead so it's not so RAM-heavy). During testing, 20% unseen data.
@@ -158,6 +232,8 @@ def _db_to_dataframe_main(conn, limit='ALL', offset=0, just_count=False, arbitra
         "Kraken < GDAX? Buy in Kraken!". It's not a gaurantee, so this is a hyper in hypersearch.py.
     :param last_timestamp: When we're in live-mode, we run till the last row in our database, use this arg to track
         where we left off, wait, poll if new rows, repeat.
+    :param since: only fetch rows newer than this timestamp (keyset, for live-mode's fetch_more())
+    :param raw: skip imputing & casting, return the frame as the DB gave it (benchmarks/pipeline.py times those separately)
     :return: pd.DataFrame, with NaNs imputed according to the F/B/Z rules
     """
     tables_ = get_tables(arbitrage)
@@ -183,12 +259,12 @@ def _db_to_dataframe_main(conn, limit='ALL', offset=0, just_count=False, arbitra
         if i == 0:
             query += f" from {name}"
             continue
-        prior = tables_[i-1]
+        # Against the main table's time (the prior lateral alias only selects `cols`, it has no ts for a 3rd+ table)
         query += f"""
             left join lateral (
               select {', '.join(c for c in table['cols'])}
               from {name}
-              where {name}.{ts} <= {prior['name']}.{prior['ts']}
+              where {name}.{ts} <= {first['name']}.{first['ts']}
               order by {name}.{ts} desc
               limit 1 
             ) {name} on true
@@ -199,21 +275,29 @@ def _db_to_dataframe_main(conn, limit='ALL', offset=0, just_count=False, arbitra
         return conn.execute(query).fetchone()[0]
 
     order_field = f"{first['name']}.{first['ts']}" if len(tables_) > 1 else first['ts']
+    params, where = {}, []
+    if last_timestamp:
+        # Save away last-timestamp (used in LIVE mode to track where we left off). Fetched first & used as an upper
+        # bound, so rows inserted while we're querying don't get skipped next time
+        ts_query = f"select {first['ts']} from {first['name']} order by {first['ts']} desc limit 1"
+        params['upto'] = last_timestamp = conn.execute(ts_query).fetchone()[first['ts']]
+        where.append(f"{order_field} <= :upto")
+    if since is not None:
+        params['since'] = since
+        where.append(f"{order_field} > :since")
+    if where:
+        query += " where " + " and ".join(where)
     query += f" order by {order_field} desc limit {limit} offset {offset}"
 
     # order by date DESC (for limit to cut right), then reverse again (so old->new)
-    df = pd.read_sql_query(query, conn).iloc[::-1]
-    for t in tables_:
-        for k, method in t['cols'].items():
-            fill = {'value': 0} if method == Z else {'method': 'ffill' if method == F else 'bfill'}
-            col_name = f"{t['name']}_{k}"
-            df[col_name] = df[col_name].fillna(fill)
-    df = df.astype('float64')
+    import pandas as pd
+    df = pd.read_sql_query(text(query), conn, params=params).iloc[::-1]
+    if raw:
+        return df
+    # Postgres doubles come back float64 already, so this is a no-op rather than another full copy of the frame
+    df = impute(df, tables_).astype('float64', copy=False)
 
     if last_timestamp:
-        # Save away last-timestamp (used in LIVE mode to inform how many new steps are added between polls
-        query = f"select {first['ts']} from {first['name']} order by {first['ts']} desc limit 1"
-        last_timestamp = conn.execute(query).fetchone()[first['ts']]
         return df, last_timestamp
     return df
 
@@ -222,19 +306,103 @@ db_to_dataframe = _db_to_dataframe_ohlc if 'coins' in DB else _db_to_dataframe_m
 
 
 def fetch_more(conn, last_timestamp, arbitrage):
-    """Function used to fetch more data in `live` mode in a polling loop.
+    """Function used to fetch more data in `live` mode (see LiveFeed for waiting on it). Fetches just the rows newer
+    than `last_timestamp`, in one query.
     TODO this approach won't work if we switch the `arbitrage` method from OUTER JOIN to INNER (see comments in
     _db_to_dataframe_main()
     """
-    t = tables[0]
-    query = f"select count(*) as ct from {t['name']} where {t['ts']} > :last_timestamp"
-    n_new = conn.execute(text(query), last_timestamp=last_timestamp).fetchone()['ct']
+    new_data, latest_timestamp = db_to_dataframe(conn, arbitrage=arbitrage, last_timestamp=True, since=last_timestamp)
+    n_new = new_data.shape[0]
     if n_new == 0:
         return None, 0, last_timestamp
-    new_data, latest_timestamp = db_to_dataframe(conn, limit=n_new, arbitrage=arbitrage, last_timestamp=True)
     return new_data, n_new, latest_timestamp
 
 
+# Postgres LISTEN/NOTIFY channel the live DB signals on when new ticker rows land (see setup_live_notify())
+LIVE_CHANNEL = 'new_rows'
+
+
+class LiveFeed(object):
+    """Lets live-mode wake as soon as new rows land instead of sleeping 20s between polls. LISTENs on LIVE_CHANNEL,
+    which a trigger on the live DB NOTIFYs on every insert (setup_live_notify()), so whatever collector fills that DB
+    needn't know about us. If the trigger's not set up, wait() just times out and we're back to polling.
+    """
+    def __init__(self, engine, timeout=20):
+        self.timeout = timeout
+        # LISTEN is per-connection, so this gets its own (raw psycopg2, autocommit so notifies aren't held up)
+        self.conn = engine.raw_connection()
+        self.conn.set_isolation_level(0)
+        self.conn.cursor().execute(f"listen {LIVE_CHANNEL}")
+
+    def fetch_initial(self, conn, limit, arbitrage):
+        return db_to_dataframe(conn, limit=limit, arbitrage=arbitrage, last_timestamp=True)
+
+    def fetch_more(self, conn, last_timestamp, arbitrage):
+        return fetch_more(conn, last_timestamp, arbitrage)
+
+    def wait(self):
+        """Blocks until the next notify (or timeout). Returns True if notified"""
+        if select.select([self.conn], [], [], self.timeout) == ([], [], []):
+            return False
+        self.conn.poll()
+        notified = bool(self.conn.notifies)
+        del self.conn.notifies[:]  # one wake per batch of inserts is plenty, fetch_more() gets all of them
+        return notified
+
+    def close(self): self.conn.close()
+
+
+class ReplayFinished(Exception): pass
+
+
+class ReplayFeed(object):
+    """Stand-in for LiveFeed which feeds stored history into the live code-path (fetch_more, re-transforming,
+    ordering, etc) one row per tick, so it can be exercised & timed without waiting for real minutes to pass. Ticks
+    come every `interval / speedup` seconds (speedup=0 for as-fast-as-possible). Raises ReplayFinished once `df` is
+    used up. "Timestamps" here are just row positions.
+    """
+    def __init__(self, df, speedup=0, interval=60):
+        self.df = df
+        self.delay = interval / speedup if speedup else 0
+        self.pos = 0
+        self.next_tick = 0
+
+    def fetch_initial(self, conn, limit, arbitrage):
+        self.pos = min(limit, self.df.shape[0] - 1)
+        self.next_tick = time.time() + self.delay
+        return self.df.iloc[:self.pos], self.pos
+
+    def fetch_more(self, conn, last_timestamp, arbitrage):
+        if self.pos >= self.df.shape[0]:
+            raise ReplayFinished()
+        time.sleep(max(0, self.next_tick - time.time()))
+        self.next_tick = max(self.next_tick, time.time()) + self.delay
+        self.pos += 1
+        return self.df.iloc[self.pos - 1:self.pos], 1, self.pos
+
+    def wait(self): pass
+
+    def close(self): pass
+
+
+def setup_live_notify():
+    """Run this once against your live DB (see README). Has the target table NOTIFY LiveFeed on every insert"""
+    t = tables[0]
+    conn = engine_live.connect()
+    conn.execute(f"""
+        create or replace function notify_new_rows() returns trigger as $$
+        begin
+          perform pg_notify('{LIVE_CHANNEL}', '');
+          return null;
+        end;
+        $$ language plpgsql;
+        drop trigger if exists {t['name']}_notify on {t['name']};
+        create trigger {t['name']}_notify after insert on {t['name']}
+          for each statement execute procedure notify_new_rows();
+    """)
+    conn.close()
+
+
 def setup_runs_table():
     """Run this function once during project setup (see README). Or just copy/paste the SQL into your runs database
     """
@@ -250,6 +418,68 @@ def setup_runs_table():
             prices double precision[],
             uniques double precision[],
             flag varchar(16),
-            agent varchar(64) default 'ppo_agent'::character varying not null
+            agent varchar(64) default 'ppo_agent'::character varying not null,
+            pruned boolean default false not null,
+            fidelity double precision default 1 not null,
+            dataset_id integer,
+            actions_z bytea,
+            timings jsonb,
+            folds jsonb
         );
-    """)
\ No newline at end of file
+        create table if not exists datasets
+        (
+            id serial primary key,
+            hash char(40) unique not null,
+            prices bytea not null
+        );
+    """)
+    # Columns added since the original table; no-op on fresh setups
+    conn_runs.execute("""
+        alter table runs add column if not exists pruned boolean default false not null;
+        alter table runs add column if not exists fidelity double precision default 1 not null;
+        alter table runs add column if not exists dataset_id integer;
+        alter table runs add column if not exists actions_z bytea;
+        alter table runs add column if not exists timings jsonb;
+        alter table runs add column if not exists folds jsonb;
+        create index if not exists runs_flag_id on runs (flag, id);
+    """)
+
+
+def pack_array(arr):
+    """Runs used to store prices/actions as Postgres double[] - MBs per run. float32 + zlib is plenty for viz"""
+    return zlib.compress(np.asarray(arr, dtype=np.float32).tobytes())
+
+
+def unpack_array(blob):
+    return np.frombuffer(zlib.decompress(blob), dtype=np.float32)
+
+
+def save_prices(conn_runs, prices):
+    """Every run tests on the same test-split, so store its prices once per dataset version (keyed by content hash)
+    and have runs reference it by `dataset_id`. Returns that id.
+    """
+    blob = pack_array(prices)
+    hash = hashlib.sha1(blob).hexdigest()
+    conn_runs.execute(text("insert into datasets (hash, prices) values (:hash, :prices) on conflict do nothing"),
+                      hash=hash, prices=blob)
+    return conn_runs.execute(text("select id from datasets where hash=:hash"), hash=hash).fetchone().id
+
+
+def normalize_runs_table():
+    """One-off migration for runs saved before the `datasets` table: moves each run's prices/actions arrays into
+    `dataset_id`/`actions_z`. Run `vacuum full runs` afterwards to actually reclaim the space.
+    """
+    conn_runs = engine_runs.connect()
+    ids = conn_runs.execute("select id from runs where prices is not null or actions is not null").fetchall()
+    for i, r in enumerate(ids):
+        run = conn_runs.execute(text("select prices, actions from runs where id=:id"), id=r.id).fetchone()
+        conn_runs.execute(
+            text("""
+              update runs set dataset_id=:dataset_id, actions_z=:actions_z, prices=null, actions=null where id=:id
+            """),
+            id=r.id,
+            dataset_id=save_prices(conn_runs, run.prices) if run.prices else None,
+            actions_z=pack_array(run.actions) if run.actions else None
+        )
+        if i % 100 == 0: print(f"{i}/{len(ids)}")
+    conn_runs.close()
\ No newline at end of file
@@ -0,0 +1,193 @@
+"""Exchange plumbing for live-mode. The env's step loop shouldn't wait on the exchange: an order or balance-check
+that takes a few seconds (or hangs) would otherwise add straight to decision latency, or stall the bot altogether.
+So orders & balance refreshes go to a background thread, and the env works off the last-known balances. There's also
+SimExchange, a local GDAX stand-in for running live-mode offline.
+"""
+
+import time, uuid, threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+def parse_balances(accounts):
+    """GDAX get_accounts() -> (usd, btc)"""
+    usd = float([a for a in accounts if a['currency'] == 'USD'][0]['balance'])
+    btc = float([a for a in accounts if a['currency'] == 'BTC'][0]['balance'])
+    return usd, btc
+
+
+class AsyncExchange(object):
+    """Wraps an exchange client (gdax.AuthenticatedClient or anything w/ the same buy/sell/get_accounts) so calls run
+    on a background thread. buy()/sell()/refresh() return immediately; call reconcile() each step to collect whatever
+    has come back, and read `balances` for the last-known (usd, btc).
+
+    Retries: balance-checks that raise (network errors) are retried RETRIES times w/ backoff. Orders never are - a
+    timeout / reset can come after GDAX got the order, and a market order resubmitted is a second fill (client_oid is
+    only a tag, GDAX doesn't de-dupe on it). Instead a failed order is looked up by its client_oid among recent orders;
+    if it's not there we give up on it and refresh balances, so the env reconciles against what actually happened.
+    Error responses (insufficient funds, etc) aren't retried either. Timeouts: a thread can't be killed, so a call
+    that's been out longer than TIMEOUT is just dropped from `pending` (and logged); its result is ignored if it ever
+    lands.
+    """
+    TIMEOUT = 15
+    RETRIES = 3
+    BACKOFF = 1.
+
+    def __init__(self, client, product_id='BTC-USD', latency=None):
+        """
+        :param latency: optional metrics.Latency to record each call's submit-to-response time in (`order_rtt`,
+            `accounts_rtt`), as of when reconcile() collects it
+        """
+        self.client = client
+        self.product_id = product_id
+        self.latency = latency
+        self.pool = ThreadPoolExecutor(max_workers=2)
+        self.pending = []  # [(kind, submitted_at, future)]
+        self.balances = None
+        self.balances_at = 0
+
+    def _with_retries(self, fn, **kwargs):
+        for attempt in range(self.RETRIES + 1):
+            try:
+                return fn(**kwargs)
+            except Exception as e:
+                if attempt == self.RETRIES: raise
+                print(f"Exchange call failed ({e}), retrying")
+                time.sleep(self.BACKOFF * 2 ** attempt)
+
+    def _find_order(self, client_oid):
+        """Our order w/ this client_oid among recent ones, or None. gdax-python's get_orders() gives a list of pages"""
+        pages = self.client.get_orders(product_id=self.product_id, status='all')
+        for order in (o for page in pages for o in (page if isinstance(page, list) else [page])):
+            if isinstance(order, dict) and order.get('client_oid') == client_oid:
+                return order
+        return None
+
+    def _order(self, fn, **kwargs):
+        try:
+            return fn(**kwargs)
+        except Exception as e:
+            print(f"Exchange order failed ({e}), checking whether it went through")
+        try:
+            order = self._find_order(kwargs['client_oid'])
+        except Exception as e:
+            raise RuntimeError(f"Order {kwargs['client_oid']} in unknown state, couldn't look it up ({e})")
+        if order is None:
+            raise RuntimeError(f"Order {kwargs['client_oid']} not found on the exchange, not resubmitting")
+        return order
+
+    def _submit(self, kind, fn, **kwargs):
+        # Timed from here till the response (incl. retries / the order look-up). Stashed on the future by the worker
+        # thread, recorded by reconcile() on ours - Latency isn't thread-safe
+        start = time.perf_counter()
+        # Orders go through _order() (no retries), balance-checks through _with_retries()
+        if kind == 'accounts':
+            future = self.pool.submit(self._with_retries, fn, **kwargs)
+        else:
+            future = self.pool.submit(self._order, fn, **kwargs)
+        future.add_done_callback(lambda f: setattr(f, 'rtt', time.perf_counter() - start))
+        self.pending.append((kind, time.time(), future))
+        return future
+
+    def buy(self, size):
+        return self._submit('buy', self.client.buy, size=float(size), product_id=self.product_id,
+                            client_oid=str(uuid.uuid4()))
+
+    def sell(self, size):
+        return self._submit('sell', self.client.sell, size=float(size), product_id=self.product_id,
+                            client_oid=str(uuid.uuid4()))
+
+    def refresh(self):
+        """Kick off a balance refresh (skipped if one's already out)"""
+        if any(kind == 'accounts' for kind, _, _ in self.pending): return
+        self._submit('accounts', self.client.get_accounts)
+
+    def reconcile(self):
+        """Collect finished calls. Updates `balances` from the latest account refresh; logs order errors/timeouts"""
+        still_pending, refresh = [], False
+        for kind, submitted_at, future in self.pending:
+            if not future.done():
+                if time.time() - submitted_at > self.TIMEOUT:
+                    print(f"Exchange {kind} timed out after {self.TIMEOUT}s, dropping")
+                else:
+                    still_pending.append((kind, submitted_at, future))
+                continue
+            if self.latency and hasattr(future, 'rtt'):
+                self.latency.record('accounts_rtt' if kind == 'accounts' else 'order_rtt', future.rtt)
+            try:
+                res = future.result()
+            except Exception as e:
+                print(f"Exchange {kind} failed: {e}")
+                if kind != 'accounts': refresh = True  # whatever the order did, balances will tell
+                continue
+            if kind == 'accounts':
+                if submitted_at >= self.balances_at:
+                    self.balances, self.balances_at = parse_balances(res), submitted_at
+            elif isinstance(res, dict) and 'message' in res:
+                print(f"Exchange {kind} rejected: {res['message']}")
+        self.pending = still_pending
+        if refresh: self.refresh()
+        return self.balances
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+
+
+class SimExchange(object):
+    """Local stand-in for gdax.AuthenticatedClient (same buy/sell/get_accounts), for running the whole live loop
+    offline: load-testing, benchmarking tick-to-order latency, CI boxes w/o network or GDAX keys. Fills market orders
+    against `price_fn()` (eg the latest price in the live/history DB) with a simple model:
+    - latency: each call sleeps uniform(*latency) seconds, like a round-trip to GDAX
+    - slippage: fill price moves against us by `slippage` (fraction) plus `impact` per BTC of order size
+    - partial fills: with probability `partial_prob`, only uniform(.5, 1) of the size fills
+    - fees: taker `fee` on the filled notional, same as execute() charges
+    """
+    def __init__(self, price_fn, usd=1000., btc=.1, fee=.0025, slippage=.0005, impact=.001, partial_prob=.1,
+                 latency=(.05, .3)):
+        self.price_fn = price_fn
+        self.usd, self.btc = usd, btc
+        self.fee, self.slippage, self.impact = fee, slippage, impact
+        self.partial_prob, self.latency = partial_prob, latency
+        self.lock = threading.Lock()
+        self.orders = []
+
+    def _sleep(self):
+        time.sleep(np.random.uniform(*self.latency))
+
+    def _order(self, side, size, product_id='BTC-USD', **kwargs):
+        self._sleep()
+        with self.lock:
+            size = float(size)
+            filled = size * np.random.uniform(.5, 1.) if np.random.random() < self.partial_prob else size
+            move = self.slippage + self.impact * size
+            price = float(self.price_fn()) * (1 + move if side == 'buy' else 1 - move)
+            notional = filled * price
+            fees = notional * self.fee
+            if side == 'buy':
+                if notional + fees > self.usd: return {'message': 'Insufficient funds'}
+                self.usd -= notional + fees
+                self.btc += filled
+            else:
+                if filled > self.btc: return {'message': 'Insufficient funds'}
+                self.btc -= filled
+                self.usd += notional - fees
+            order = dict(id=str(uuid.uuid4()), client_oid=kwargs.get('client_oid'), product_id=product_id, side=side,
+                         type='market', size=str(size), filled_size=str(filled), executed_value=str(notional),
+                         fill_fees=str(fees), status='done', settled=True)
+            self.orders.append(order)
+            return order
+
+    def buy(self, **kwargs): return self._order('buy', **kwargs)
+
+    def sell(self, **kwargs): return self._order('sell', **kwargs)
+
+    def get_orders(self, product_id='BTC-USD', **kwargs):
+        self._sleep()
+        with self.lock:
+            return [[o for o in self.orders if o['product_id'] == product_id]]
+
+    def get_accounts(self):
+        self._sleep()
+        with self.lock:
+            return [dict(currency='USD', balance=str(self.usd), available=str(self.usd)),
+                    dict(currency='BTC', balance=str(self.btc), available=str(self.btc))]
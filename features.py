@@ -0,0 +1,183 @@
+"""Feature kernels for BitcoinEnv._xform_data(), in plain NumPy over a whole matrix of columns at once (rather than
+a pandas Series per column). Plus the on-disk cache of transformed datasets.
+"""
+
+import os, json, glob, shutil, hashlib, fcntl, warnings
+from contextlib import contextmanager
+import numpy as np
+
+# 99th percentile and up is an outlier (timeseries holes, pump-and-dumps), see diff()
+OUTLIER_Q = 99
+# With hypers.rolling_outliers, the outlier threshold is over this many trailing rows (~1 week of minutes) rather than
+# the whole dataset. Live-mode keeps this many extra rows around so it computes the same thing (see use_dataset())
+OUTLIER_WINDOW = 10080
+
+# Transformed datasets (observations, prices, prices_diff) are cached, so trials on the same data skip the DB fetch
+# and all the transforms/indicators. Two tiers: on disk (CACHE_DIR, the CACHE_MAX most recent) and in shared memory
+# (SHM_DIR, the SHM_MAX most recent), which every process on the box maps read-only - so RAM stays flat however many
+# hypersearch.py / run.py processes share a dataset. Either None to disable
+CACHE_DIR = os.path.dirname(__file__) + '/.feature_cache'
+CACHE_MAX = 20
+SHM_DIR = '/dev/shm/tforce_btc' if os.path.isdir('/dev/shm') else None
+SHM_MAX = 4
+# Bump when the transforms change (this file, indicators.py, _xform_data) so stale caches aren't used
+VERSION = 2
+# Per cache entry. obs goes last, its presence means the entry's complete
+ARRAYS = ('prices', 'prices_diff', 'obs')
+
+
+def _fill(A, forward):
+    for row in A:
+        mask = np.isnan(row)
+        nans = np.flatnonzero(mask)
+        if not nans.size: continue
+        valid = np.flatnonzero(~mask)
+        # nearest valid value before (ffill) / after (bfill) each NaN. Holes are sparse, so this beats filling the
+        # whole row
+        src = np.searchsorted(valid, nans) - (1 if forward else 0)
+        ok = (src >= 0) if forward else (src < valid.size)
+        row[nans[ok]] = row[valid[src[ok]]]
+    return A
+
+
+def ffill(A):
+    """Forward-fill NaNs along each row of 2d A, in place. Leading NaNs stay"""
+    return _fill(A, forward=True)
+
+
+def bfill(A):
+    """Back-fill NaNs along each row of 2d A, in place"""
+    return _fill(A, forward=False)
+
+
+def diff(X, percent=False, outlier_window=None):
+    """Row-over-row change of each column of X (2d, or 1d for a single column) -> float64 same shape. The first row
+    is 0 (nothing to compare to). Outliers - changes above the OUTLIER_Q percentile of their column - and infs (pct
+    change from 0) are dropped and forward-filled (then back-filled, for any leading ones).
+
+    :param percent: percent-change instead of absolute diff. Like pandas' pct_change(), NaN inputs are forward-filled
+        first so a hole doesn't turn into two NaN changes
+    :param outlier_window: if set, an outlier is relative to the trailing `outlier_window` rows (causal, so backtests
+        transform the same way live-mode does on its short window). Else relative to the whole column, which peeks
+        ahead
+    """
+    X = np.asarray(X, dtype=np.float64)
+    squeeze = X.ndim == 1
+    # Work column-major (one contiguous row per feature). A DataFrame's .values is usually a transposed view already
+    A = np.ascontiguousarray(X[None, :] if squeeze else X.T)
+
+    out = np.empty_like(A)
+    out[:, 0] = 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if percent:
+            A = ffill(A.copy())
+            np.divide(A[:, 1:], A[:, :-1], out=out[:, 1:])
+            out[:, 1:] -= 1
+        else:
+            np.subtract(A[:, 1:], A[:, :-1], out=out[:, 1:])
+
+        if outlier_window:
+            import pandas as pd
+            out[~np.isfinite(out)] = np.nan
+            q = pd.DataFrame(out.T).rolling(outlier_window, min_periods=1).quantile(OUTLIER_Q / 100.).values.T
+        else:
+            # infs count toward the global percentile, same as the original pandas version
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN column, inf-inf
+                q = np.nanpercentile(out, OUTLIER_Q, axis=1)[:, None]
+        out[out > q] = np.nan
+    out[np.isinf(out)] = np.nan
+    bfill(ffill(out))
+    return out[0] if squeeze else out.T
+
+
+def cache_key(**parts):
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _read(dir, key, mmap_mode=None):
+    try:
+        arrays = {a: np.load(f'{dir}/{key}.{a}.npy', mmap_mode=mmap_mode) for a in reversed(ARRAYS)}
+    except IOError:
+        return None
+    return arrays['obs'], arrays['prices'], arrays['prices_diff']
+
+
+def _write(dir, key, arrays, max_entries):
+    """Best-effort: a full disk / small tmpfs (Docker's /dev/shm is 64MB by default) just means no caching. Returns
+    whether it was written"""
+    try:
+        os.makedirs(dir, exist_ok=True)
+        # Leave some headroom, rather than fill the tmpfs/disk other things are using
+        if shutil.disk_usage(dir).free < sum(arrays[a].nbytes for a in ARRAYS) * 1.2:
+            print(f"Not caching features in {dir}, not enough free space")
+            return False
+    except OSError:
+        return False
+    # Write-then-rename, so other processes never load a half-written file
+    for a in ARRAYS:
+        tmp = f'{dir}/{key}.{a}.{os.getpid()}.tmp.npy'
+        try:
+            np.save(tmp, arrays[a])
+            os.rename(tmp, f'{dir}/{key}.{a}.npy')
+        except OSError as e:
+            print(f"Couldn't cache features in {dir}: {e}")
+            # The tmp file, and this entry's arrays written so far (w/o obs nothing would ever prune them)
+            for f in [tmp] + [f'{dir}/{key}.{a}.npy' for a in ARRAYS]:
+                try: os.remove(f)
+                except OSError: pass
+            return False
+
+    try:
+        entries = sorted(glob.glob(f'{dir}/*.obs.npy'), key=os.path.getmtime)
+    except OSError:
+        return True  # another process pruning, leave it to them
+    for old in entries[:-max_entries]:
+        old = old[:-len('.obs.npy')]
+        # Processes which have these mapped keep them 'til they're done (unlinked files live on while mapped)
+        for f in [f'{old}.{a}.npy' for a in ARRAYS] + [f'{old}.lock']:
+            try: os.remove(f)
+            except OSError: pass
+    return True
+
+
+def cache_load(key):
+    """(observations, prices, prices_diff) or None. From shared memory, read-only & zero-copy (published there from
+    the disk cache first if need be)"""
+    if SHM_DIR:
+        arrays = _read(SHM_DIR, key, mmap_mode='r')
+        if arrays: return arrays
+    if not CACHE_DIR: return None
+    arrays = _read(CACHE_DIR, key)
+    if arrays and SHM_DIR and _write(SHM_DIR, key, dict(zip(('obs', 'prices', 'prices_diff'), arrays)), SHM_MAX):
+        return _read(SHM_DIR, key, mmap_mode='r') or arrays
+    return arrays
+
+
+def cache_save(key, observations, prices, prices_diff):
+    """Best-effort (see _write). Returns whether it made it to shared memory - if not, callers are better off
+    carrying on w/ their own arrays than re-reading them from disk"""
+    arrays = dict(obs=observations, prices=prices, prices_diff=prices_diff)
+    if CACHE_DIR: _write(CACHE_DIR, key, arrays, CACHE_MAX)
+    return bool(SHM_DIR) and _write(SHM_DIR, key, arrays, SHM_MAX)
+
+
+@contextmanager
+def cache_lock(key):
+    """Held while building `key`'s entry, so other processes wanting it wait & load it rather than all building it"""
+    dir = SHM_DIR or CACHE_DIR
+    if not dir:
+        yield
+        return
+    try:
+        os.makedirs(dir, exist_ok=True)
+        f = open(f'{dir}/{key}.lock', 'w')
+    except OSError:
+        yield  # just no locking
+        return
+    with f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -167,8 +167,9 @@ def bayesian_optimisation(n_iters, sample_loss, bounds, x0=None, n_pre_samples=5
         else:
             next_sample = sample_next_hyperparameter(expected_improvement, model, yp, greater_is_better=True, bounds=bounds, n_restarts=100)
 
-        # Duplicates will break the GP. In case of a duplicate, we will randomly sample a next query point.
-        if np.any(np.abs(next_sample - xp) <= epsilon):
+        # Duplicates will break the GP. In case of a duplicate, we will randomly sample a next query point. Whole rows,
+        # a shared coordinate (a bool, pinned fidelity) doesn't make it a duplicate
+        if np.all(np.abs(next_sample - xp) <= epsilon, axis=1).any():
             next_sample = np.random.uniform(bounds[:, 0], bounds[:, 1], bounds.shape[0])
 
         # Sample loss for new set of parameters
@@ -210,8 +211,9 @@ def bayesian_optimisation2(loss_fn, bounds, x_list=[], y_list=[], n_pre_samples=
     # Sample next hyperparameter
     next_sample = sample_next_hyperparameter(expected_improvement, model, yp, greater_is_better=True, bounds=bounds, n_restarts=100)
 
-    # Duplicates will break the GP. In case of a duplicate, we will randomly sample a next query point.
-    if np.any(np.abs(next_sample - xp) <= epsilon):
+    # Duplicates will break the GP. In case of a duplicate, we will randomly sample a next query point. Whole rows,
+    # a shared coordinate (a bool, pinned fidelity) doesn't make it a duplicate
+    if np.all(np.abs(next_sample - xp) <= epsilon, axis=1).any():
         next_sample = np.random.uniform(bounds[:, 0], bounds[:, 1], bounds.shape[0])
 
     # Sample loss for new set of parameters
@@ -18,20 +18,16 @@ Each hyper is specified as `key: {type, vals, guess, pre/post/hydrate}`.
         database looking like this. Eg, baseline_mode, when set to True, does a number on many other hypers.
 """
 
-import argparse, json, math, time, pdb
+import argparse, json, math, os, shutil, time, pdb
 from pprint import pprint
 from box import Box
 import numpy as np
-import pandas as pd
-import tensorflow as tf
 from sqlalchemy.sql import text
-from tensorforce.agents import agents as agents_dict
-from tensorforce.core.networks import layer as TForceLayers
-from tensorforce.core.networks.network import LayeredNetwork
-from sklearn.ensemble import GradientBoostingRegressor
-from sklearn.model_selection import GridSearchCV
 
+import btc_env
 from btc_env import BitcoinEnv
+import features
+from metrics import Profiler
 import utils
 from data import data
 
@@ -128,6 +124,10 @@ def custom_net(hypers, print_net=False, baseline=False):
     network downstream, after the time-series layers. Makes more sense to me that way: imagine the conv layers saying
     "the price is right, buy!" and then getting handed a note with "you have $0 USD". "Oh.. nevermind..."
     """
+    import tensorflow as tf
+    from tensorforce.core.networks import layer as TForceLayers
+    from tensorforce.core.networks.network import LayeredNetwork
+
     layers_spec = build_net_spec(hypers, baseline)
     if print_net: pprint(layers_spec)
 
@@ -301,6 +301,11 @@ hypers['custom'] = {
         'type': 'bool',
         'guess': True
     },
+    # On top of those, the rest of indicators.py's registry (EMAs, 50/200-SMA, VWAP, prior-day close, Bollinger)
+    'extra_indicators': {
+        'type': 'bool',
+        'guess': False
+    },
     # Conv / LSTM layers
     'net.depth_mid': {
         'type': 'bounded',
@@ -366,6 +371,12 @@ hypers['custom'] = {
         'type': 'bool',
         'guess': False
     },
+    # Judge outlier price-actions against a trailing window (features.OUTLIER_WINDOW) rather than the whole dataset.
+    # Causal, so backtests see features the way live-mode will
+    'rolling_outliers': {
+        'type': 'bool',
+        'guess': False
+    },
     # True = one action (-$x to +$x). False = two actions: (buy|sell|hold) and (how much?)
     'single_action': {
         'type': 'bool',
@@ -466,6 +477,14 @@ class DotDict(object):
         return self._data
 
 
+# Runs are fetched incrementally (main(), HSearchEnv.prune_curves()), re-checking this many ids back for ones that
+# committed out of order
+RUNS_LOOKBACK = 200
+
+# {flag: {run id: advantages}}, see HSearchEnv.prune_curves()
+_prune_curves = {}
+
+
 class HSearchEnv(object):
     """This was once a TensorForce environment of its own, when I was using RL to find the best hyper-combo for RL.
     I turned from that to Bayesian Optimization, but that's why this is an awkward class of its own - it should be
@@ -473,7 +492,8 @@ class HSearchEnv(object):
 
     TODO only tested with ppo_agent. Test with other agents
     """
-    def __init__(self, agent='ppo_agent', gpu_split=1, net_type='conv2d'):
+    def __init__(self, agent='ppo_agent', gpu_split=1, net_type='conv2d', prune=-1, replicas=1, profile=False,
+                 folds=1, fold_procs=0, async_tests=False, checkpoint=None):
         hypers_ = hypers[agent].copy()
         hypers_.update(hypers['custom'])
         hypers_['net.type'] = net_type  # set as hard-coded val
@@ -488,6 +508,16 @@ class HSearchEnv(object):
         self.hardcoded = hardcoded
         self.gpu_split = gpu_split
         self.net_type = net_type
+        self.prune = prune
+        self.replicas = replicas
+        self.profile = profile
+        self.folds = folds
+        self.fold_procs = fold_procs or folds
+        self.async_tests = async_tests
+        # Directory for this process' in-progress trial (see resume()), None to not checkpoint
+        self.checkpoint = checkpoint
+        # Score (utils.calculate_score) of the prior runs execute() re-used instead of running, if it did
+        self.reused_score = None
         self.conn = data.engine.connect()
         self.conn_runs = data.engine_runs.connect()
 
@@ -541,6 +571,7 @@ class HSearchEnv(object):
         # GPU split
         session_config = None
         if self.gpu_split != 1:
+            import tensorflow as tf
             fraction = .9 / self.gpu_split if self.gpu_split > 1 else self.gpu_split
             session_config = tf.ConfigProto(gpu_options=tf.GPUOptions(per_process_gpu_memory_fraction=fraction))
         main['session_config'] = session_config
@@ -552,42 +583,181 @@ class HSearchEnv(object):
 
         return flat, main, network
 
-    def execute(self, actions):
-        flat, hydrated, network = self.get_hypers(actions)
+    def find_duplicates(self, flat, fidelity=1.):
+        """Many hypers get rounded/thresholded/binned in their pre/post hooks, so distinct BO vectors often collapse
+        into the exact same effective `flat` combo. Returns prior runs of this exact combo (jsonb equality, so key-order
+        and int/float formatting don't matter) at this fidelity.
+        """
+        sql = """
+          select advantages, advantage_avg from runs 
+          where flag=:f and fidelity=:fidelity and hypers=cast(:hypers as jsonb)
+        """
+        return self.conn_runs.execute(text(sql), f=self.net_type, fidelity=fidelity, hypers=json.dumps(flat)).fetchall()
 
-        env = BitcoinEnv(flat, name=self.agent)
-        agent = agents_dict[self.agent](
-            states_spec=env.states,
-            actions_spec=env.actions,
-            network_spec=network,
-            **hydrated
-        )
+    def execute(self, actions, fidelity=1.):
+        flat, hydrated, network = self.get_hypers(actions)
 
-        env.train_and_test(agent)
+        if self.replicas > 0:
+            dupes = self.find_duplicates(flat, fidelity)
+            if len(dupes) >= self.replicas:
+                adv_avg = np.mean([r.advantage_avg for r in dupes])
+                self.reused_score = np.mean([utils.calculate_score(r) for r in dupes])
+                print(f"Already ran this exact combo {len(dupes)}x, re-using its Advantage={adv_avg}\n\n")
+                self.clear_checkpoint()
+                return adv_avg
+
+        if self.checkpoint:
+            # Note the trial, so if this process dies resume() can re-run it from its checkpoints
+            os.makedirs(self.checkpoint, exist_ok=True)
+            with open(f'{self.checkpoint}/trial.json.tmp', 'w') as f:
+                json.dump(dict(flat=flat, fidelity=fidelity), f)
+            os.rename(f'{self.checkpoint}/trial.json.tmp', f'{self.checkpoint}/trial.json')
+
+        profiler = Profiler(enabled=self.profile)
+        if self.folds > 1:
+            with profiler.span('folds'):
+                folds = self.run_folds(flat, fidelity)
+            # Score per test-round is the mean across folds (rounds a pruned fold didn't get to are left out)
+            n_rounds = max(len(f['advantages']) for f in folds)
+            pad = lambda k: [f[k] + [np.nan] * (n_rounds - len(f[k])) for f in folds]
+            advantages, uniques = np.nanmean(pad('advantages'), 0).tolist(), np.nanmean(pad('uniques'), 0).tolist()
+            adv_avg = float(np.mean([f['advantages'][-1] for f in folds]))
+            pruned = any(f['pruned'] for f in folds)
+            # Signals/prices of the most recent fold's final test, same as a single-split run saves
+            res = folds[0]
+        else:
+            checkpoint = f'{self.checkpoint}/trial' if self.checkpoint else None
+            res = self.train(flat, hydrated, network, fidelity, profiler=profiler, checkpoint=checkpoint)
+            advantages, uniques, adv_avg, pruned = res['advantages'], res['uniques'], res['advantages'][-1], res['pruned']
+        print(flat, f"\nAdvantage={adv_avg} (fidelity={fidelity})\n\n")
 
-        step_acc, ep_acc = env.acc.step, env.acc.episode
-        adv_avg = ep_acc.advantages[-1]
-        print(flat, f"\nAdvantage={adv_avg}\n\n")
+        with profiler.span('db'):
+            dataset_id = data.save_prices(self.conn_runs, res['prices'])
+            actions_z = data.pack_array(res['signals'])
+        if self.profile: profiler.report()
 
         sql = """
-          insert into runs (hypers, advantage_avg, advantages, uniques, prices, actions, agent, flag) 
-          values (:hypers, :advantage_avg, :advantages, :uniques, :prices, :actions, :agent, :flag)
+          insert into runs (hypers, advantage_avg, advantages, uniques, dataset_id, actions_z, agent, flag, pruned, fidelity, timings, folds) 
+          values (:hypers, :advantage_avg, :advantages, :uniques, :dataset_id, :actions_z, :agent, :flag, :pruned, :fidelity, :timings, :folds)
         """
         self.conn_runs.execute(
             text(sql),
             hypers=json.dumps(flat),
             advantage_avg=adv_avg,
-            advantages=list(ep_acc.advantages),
-            uniques=list(ep_acc.uniques),
-            prices=list(env.prices),
-            actions=list(step_acc.signals),
+            advantages=list(advantages),
+            uniques=list(uniques),
+            dataset_id=dataset_id,
+            actions_z=actions_z,
             agent=self.agent,
-            flag=self.net_type
+            flag=self.net_type,
+            pruned=pruned,
+            fidelity=fidelity,
+            timings=json.dumps(profiler.summary()) if self.profile else None,
+            folds=json.dumps([
+                dict(fold=k, advantages=f['advantages'], uniques=f['uniques'], pruned=f['pruned'], timings=f['timings'])
+                for k, f in enumerate(folds)
+            ]) if self.folds > 1 else None
         )
+        self.clear_checkpoint()
+        return adv_avg
 
+    def resume(self):
+        """Re-run the trial this process was on when it died (evicted, OOM, ...), picking up from its last checkpoint
+        rather than starting over. Returns its advantage, or None if there wasn't one"""
+        if not self.checkpoint: return None
+        try:
+            with open(f'{self.checkpoint}/trial.json') as f:
+                pending = json.load(f)
+        except IOError:
+            return None
+        print(f"Resuming unfinished trial (fidelity={pending['fidelity']})")
+        self.hardcoded = pending['flat']
+        return self.execute({}, fidelity=pending['fidelity'])
+
+    def clear_checkpoint(self):
+        if not self.checkpoint: return
+        shutil.rmtree(f'{self.checkpoint}/trial', ignore_errors=True)
+        try: os.remove(f'{self.checkpoint}/trial.json')
+        except OSError: pass
+
+    def prune_curves(self):
+        """Past runs' advantages curves, for the pruner. Only runs that went the distance: pruned ones stop early,
+        so they'd leave just the survivors at later rounds & make the threshold stricter as the search goes on. Fetched
+        once per process, after that just the runs added since"""
+        curves = _prune_curves.setdefault(self.net_type, {})
+        since = max(curves, default=0) - RUNS_LOOKBACK  # see main()
+        sql = "select id, advantages from runs where flag=:f and not pruned and id>:since and id <> all(:seen)"
+        rows = self.conn_runs.execute(text(sql), f=self.net_type, since=since,
+                                      seen=[i for i in curves if i > since] or [0]).fetchall()
+        curves.update((r.id, r.advantages) for r in rows)
+        return list(curves.values())
+
+    def train(self, flat, hydrated, network, fidelity=1., fold=None, profiler=None, checkpoint=None, curves=None):
+        """Build the agent & env, train_and_test(). Returns the run's results: advantages, uniques, pruned, and the
+        final test's signals & prices (plus timings if profiling). `fold`: (k, n_folds) for a walk-forward fold.
+        `checkpoint`: directory to checkpoint to / resume from, see BitcoinEnv.train_and_test(). `curves`: the
+        pruner's past-run curves, if already fetched (see prune_curves())"""
+        from tensorforce.agents import agents as agents_dict
+        profiler = profiler or Profiler(enabled=self.profile)
+        with profiler.span('build'):
+            env = BitcoinEnv(flat, name=self.agent)
+            env.profiler = profiler
+            env.fold = fold
+            make_agent = lambda: agents_dict[self.agent](
+                states_spec=env.states,
+                actions_spec=env.actions,
+                network_spec=network,
+                **hydrated
+            )
+            agent = make_agent()
+            # Second copy to run test-rounds on while the first trains (see btc_env.AsyncTester)
+            eval_agent = make_agent() if self.async_tests else None
+
+        pruner = None
+        if self.prune > 0:
+            pruner = utils.make_pruner(curves or self.prune_curves(), percentile=self.prune)
+
+        with profiler.span('train_and_test'):
+            env.train_and_test(agent, pruner=pruner, fidelity=fidelity, eval_agent=eval_agent, checkpoint=checkpoint)
+
+        step_acc, ep_acc = env.acc.step, env.acc.episode
+        res = dict(
+            advantages=list(ep_acc.advantages),
+            uniques=list(ep_acc.uniques),
+            pruned=ep_acc.pruned,
+            signals=list(step_acc.signals),
+            prices=np.array(env.prices),  # copy, env.prices may be a view of the shared feature cache
+            timings=profiler.summary() if self.profile else None
+        )
         agent.close()
+        if eval_agent: eval_agent.close()
         env.close()
-        return adv_avg
+        return res
+
+    def run_folds(self, flat, fidelity=1.):
+        """Walk-forward: train & test this combo on each of self.folds rolling train/test windows (see
+        BitcoinEnv._fold_window), in a pool of self.fold_procs processes. Every fold slices the same full-history
+        feature matrix, built once & shared through the feature cache. Returns each fold's train() results, most
+        recent fold first"""
+        import multiprocessing as mp
+        procs = min(self.fold_procs, self.folds)
+        # Each process gets its own TF session, so split the GPU further between them
+        gpu_split = self.gpu_split * procs if self.gpu_split >= 1 else self.gpu_split / procs
+        kwargs = dict(agent=self.agent, gpu_split=gpu_split, net_type=self.net_type, prune=self.prune,
+                      profile=self.profile, async_tests=self.async_tests)
+        checkpoint = lambda k: f'{self.checkpoint}/trial/fold{k}' if self.checkpoint else None
+        # Fetched once here, rather than by every fold's fresh process
+        curves = self.prune_curves() if self.prune > 0 else None
+        jobs = [(kwargs, flat, (k, self.folds), fidelity, checkpoint(k), curves) for k in range(self.folds)]
+        if features.CACHE_DIR or features.SHM_DIR:
+            # Build the full-history matrix here first (w/ this process' XFORM_PROCS), so the folds just map it
+            env = BitcoinEnv(flat, name=self.agent)
+            env.fold = (0, self.folds)
+            env.use_dataset(btc_env.Mode.TEST)
+            env.close()
+        # Spawned (TensorFlow doesn't survive a fork), and a fresh process per fold so each one's graph is freed
+        with mp.get_context('spawn').Pool(procs, maxtasksperchild=1) as pool:
+            return pool.map(_fold_worker, jobs, chunksize=1)
 
     def get_winner(self, id=None):
         if id:
@@ -605,8 +775,23 @@ class HSearchEnv(object):
         return self.get_hypers({})
 
 
+def _fold_worker(job):
+    """One walk-forward fold of HSearchEnv.run_folds(), in a process of its own. Rebuilds the agent config from the
+    flat hypers, same as get_winner() does from a saved run"""
+    kwargs, flat, fold, fidelity, checkpoint, curves = job
+    hs = HSearchEnv(**kwargs)
+    hs.hardcoded = flat
+    flat, hydrated, network = hs.get_hypers({})
+    try:
+        return hs.train(flat, hydrated, network, fidelity, fold=fold, checkpoint=checkpoint, curves=curves)
+    finally:
+        hs.close()
+
+
 def print_feature_importances(X, Y, feat_names):
     if len(X) < 5: return
+    from sklearn.ensemble import GradientBoostingRegressor
+    from sklearn.model_selection import GridSearchCV
     model = GradientBoostingRegressor()
     model_hypers = {
         'max_features': [None, 'sqrt', 'log2'],
@@ -644,8 +829,37 @@ def boost_optimization(model, loss_fn, bounds, x_list=[], y_list=[], n_pre_sampl
     loss_fn(best_params)
 
 
+def merge_duplicates(X, Y):
+    """Averages the scores of identical hyper-vectors (repeat runs of one combo), since duplicate inputs break the GP.
+    Replaces the old trick of jittering each X by a random epsilon, which hid the duplication (and its variance) from
+    the GP rather than letting it see the mean.
+    """
+    merged = {}
+    for x, y in zip(X, Y):
+        merged.setdefault(tuple(x), []).append(y[0])
+    X = [np.array(x) for x in merged]
+    Y = [[np.mean(ys)] for ys in merged.values()]
+    return X, Y
+
+
+def successive_halving(loss_fn, candidates, eta=3):
+    """One Hyperband bracket. Runs every candidate at a low fidelity (fraction of the full TIMESTEPS / training-span
+    budget), keeps the top 1/eta, re-runs those at eta-times the fidelity, and so on till the survivor(s) run at full
+    fidelity. Eg 27 candidates, eta=3: 27 @ 1/27, 9 @ 1/9, 3 @ 1/3, 1 @ 1. Every run lands in the runs table w/ its
+    fidelity, so the surrogate learns from the cheap screens too.
+    """
+    n_rungs = int(math.log(len(candidates), eta) + 1e-6)
+    for rung in range(n_rungs + 1):
+        fidelity = eta ** (rung - n_rungs)
+        print(f"Hyperband rung {rung}: {len(candidates)} candidates @ fidelity {round(fidelity, 3)}")
+        scores = [loss_fn(params, fidelity=fidelity)[0] for params in candidates]
+        ranked = sorted(zip(scores, range(len(candidates))), reverse=True)
+        candidates = [candidates[i] for _, i in ranked[:max(1, len(candidates) // eta)]]
+
+
 def main():
     import gp
+    import pandas as pd
     from sklearn.feature_extraction import DictVectorizer
 
     parser = argparse.ArgumentParser()
@@ -653,7 +867,18 @@ def main():
     parser.add_argument('-n', '--net-type', type=str, default='conv2d', help="(lstm|conv2d) Which network arch to use")
     parser.add_argument('--guess', type=int, default=-1, help="Run the hard-coded 'guess' values first before exploring")
     parser.add_argument('--boost', action="store_true", default=False, help="Use custom gradient-boosting optimization, or bayesian optimization?")
+    parser.add_argument('--prune', type=float, default=-1, help="Abort trials whose running advantage falls in this bottom percentile of past runs (eg 25)")
+    parser.add_argument('--hyperband', type=int, default=-1, help="Screen this many random combos per iteration at reduced fidelity, promoting the best (Hyperband)")
+    parser.add_argument('--eta', type=int, default=3, help="Hyperband: keep the top 1/eta each rung")
+    parser.add_argument('--replicas', type=int, default=1, help="Re-run an exact (post-hook) hyper combo only until it has this many runs; 0 to always run")
+    parser.add_argument('--xform-procs', type=int, default=0, help="Compute features in parallel w/ this many processes (see btc_env.XFORM_PROCS)")
+    parser.add_argument('--profile', action="store_true", default=False, help="Save a per-stage timing breakdown w/ each run (runs.timings)")
+    parser.add_argument('--folds', type=int, default=1, help="Score each combo on this many walk-forward train/test windows (runs.folds) instead of one 90/10 split")
+    parser.add_argument('--fold-procs', type=int, default=0, help="Walk-forward: run this many folds at once (default all of them)")
+    parser.add_argument('--async-tests', action="store_true", default=False, help="Run each test-round on a snapshot of the agent while training continues")
+    parser.add_argument('--checkpoint', type=str, default=None, help="Checkpoint trials to this directory (one per hypersearch.py process), and first resume any unfinished trial found there")
     args = parser.parse_args()
+    btc_env.XFORM_PROCS = args.xform_procs
 
     # Encode features
     hsearch = HSearchEnv(gpu_split=args.gpu_split, net_type=args.net_type)
@@ -677,6 +902,7 @@ def main():
     vectorizer = DictVectorizer()
     vectorizer.fit(mat.T.to_dict().values())
     feat_names = vectorizer.get_feature_names()
+    n_feats = len(feat_names)
 
     # Map TensorForce actions to GP-compatible `domain`
     # instantiate just to get actions (get them from hypers above?)
@@ -687,6 +913,9 @@ def main():
             bounded, min_, max_ = hyper['type'] == 'bounded', min(hyper['vals']), max(hyper['vals'])
         b = [min_, max_] if bounded else [0, 1]
         bounds.append(b)
+    # Fidelity is modeled as one more input dimension, so the surrogate can learn from low-fidelity (Hyperband) runs.
+    # It's pinned to [1, 1] so the optimizers only ever propose full-fidelity runs.
+    bounds.append([1., 1.])
 
     def hypers2vec(obj):
         h = dict()
@@ -722,25 +951,53 @@ def main():
         return obj
 
     # Specify the "loss" function (which we'll maximize) as a single rl_hsearch instantiate-and-run
-    def loss_fn(params):
-        hsearch = HSearchEnv(gpu_split=args.gpu_split, net_type=args.net_type)
-        reward = hsearch.execute(vec2hypers(params))
+    hsearch_kwargs = dict(gpu_split=args.gpu_split, net_type=args.net_type, prune=args.prune, replicas=args.replicas,
+                          profile=args.profile, folds=args.folds, fold_procs=args.fold_procs,
+                          async_tests=args.async_tests, checkpoint=args.checkpoint)
+
+    def loss_fn(params, fidelity=1.):
+        hsearch = HSearchEnv(**hsearch_kwargs)
+        reward = hsearch.execute(vec2hypers(params[:n_feats]), fidelity=fidelity)
+        if hsearch.reused_score is not None:
+            # Nothing new in the runs table, so the next fit would be the same as this one & likely propose (a point
+            # collapsing onto) this combo again. Feed the proposal in w/ the re-used score, so the next one moves on
+            X_seen.append(np.append(params[:n_feats], fidelity))
+            Y_seen.append([hsearch.reused_score])
         hsearch.close()
         return [reward]
 
+    # Finish whatever trial this process was on when it last died, before asking for new ones
+    hsearch = HSearchEnv(**hsearch_kwargs)
+    hsearch.resume()
+    hsearch.close()
+
+    # Runs already fetched & encoded (hyper-vector + fidelity, score). Runs are insert-only, so each iteration we only
+    # pull the ones added since (by this or other servers) instead of every run's JSON & advantages over the wire.
+    X_seen, Y_seen, seen_ids = [], [], set()
+
     guess_i = 0
     while True:
-        # Every iteration, re-fetch from the database & pre-train new model. Acts same as saving/loading a model to disk,
-        # but this allows to distribute across servers easily
+        # Every iteration, fetch new runs from the database & pre-train new model. Acts same as saving/loading a model
+        # to disk, but this allows to distribute across servers easily
         conn_runs = data.engine_runs.connect()
-        sql = "select hypers, advantages, advantage_avg from runs where flag=:f"
-        runs = conn_runs.execute(text(sql), f=args.net_type).fetchall()
+        # Not just id > the highest seen: w/ several servers inserting, a lower id can commit after a higher one's been
+        # read. So re-check the trailing RUNS_LOOKBACK ids for any we haven't got (only those come over the wire). A
+        # run committing more than that many ids late is still missed
+        since = max(seen_ids, default=0) - RUNS_LOOKBACK
+        sql = """
+          select id, hypers, advantages, advantage_avg, fidelity from runs 
+          where flag=:f and id>:since and id <> all(:seen) order by id
+        """
+        runs = conn_runs.execute(text(sql), f=args.net_type, since=since,
+                                 seen=[i for i in seen_ids if i > since] or [0]).fetchall()
         conn_runs.close()
-        X, Y = [], []
         for run in runs:
-            X.append(hypers2vec(run.hypers))
-            Y.append([utils.calculate_score(run)])
-        boost_model = print_feature_importances(X, Y, feat_names)
+            X_seen.append(np.append(hypers2vec(run.hypers), run.fidelity))
+            Y_seen.append([utils.calculate_score(run)])
+            seen_ids.add(run.id)
+        # (new lists; the optimizers append to these)
+        X, Y = merge_duplicates(X_seen, Y_seen)
+        boost_model = print_feature_importances(X, Y, feat_names + ['fidelity'])
 
         if args.guess != -1:
             guess = {k: v['guess'] for k, v in hypers_.items()}
@@ -753,6 +1010,12 @@ def main():
 
             continue
 
+        if args.hyperband > 0:
+            bounds_ = np.array(bounds[:n_feats])
+            candidates = list(np.random.uniform(bounds_[:, 0], bounds_[:, 1], (args.hyperband, n_feats)))
+            successive_halving(loss_fn, candidates, eta=args.eta)
+            continue
+
         if args.boost:
             print('Using gradient-boosting')
             boost_optimization(
@@ -763,12 +1026,8 @@ def main():
                 y_list=Y
             )
         else:
-            # Evidently duplicate values break GP. Many of these are ints, so they're definite duplicates. Either way,
-            # tack on some small epsilon to make them different (1e-6 < gp.py's min threshold, make sure that #'s not a
-            # problem). I'm concerned about this since many hypers can go below that epislon (eg learning-rate).
-            for x in X:
-                for i, v in enumerate(x):
-                    x[i] += np.random.random() * 1e-6
+            # Evidently duplicate values break GP. Many of these are ints, so they're definite duplicates; those were
+            # averaged into one point by merge_duplicates() above.
             gp.bayesian_optimisation2(
                 loss_fn=loss_fn,
                 bounds=np.array(bounds),
@@ -0,0 +1,89 @@
+"""Technical indicators, computed per OHLCV table in BitcoinEnv._xform_data(). Each registry entry declares:
+- fn: fn(ind) -> array (or list of arrays if width > 1), where `ind` is a dict of the table's open/high/low/close/volume
+  arrays (TA-Lib's abstract-API input format)
+- lookback: rows of history it needs to be right at the last row. Live-mode keeps the max of the selected ones around
+- width: num output columns
+
+Which ones are used is down to hypers (see selected()): `indicators` turns on BASE, `extra_indicators` adds EXTRA. To
+try a new indicator, add it to the registry and one of those lists (or a list of its own w/ a hyper to match) -
+data.n_cols() and the feature cache follow along.
+"""
+
+import numpy as np
+
+
+def _talib(name, **kwargs):
+    def fn(ind):
+        from talib import abstract
+        return getattr(abstract, name)(ind, **kwargs)
+    return fn
+
+
+def _rolling_sum(x, n):
+    c = np.cumsum(x)
+    out = c.copy()
+    out[n:] -= c[:-n]
+    return out
+
+
+def vwap(ind, timeperiod=1440):
+    """Volume-weighted average (typical) price over the trailing `timeperiod` rows (1440 = a day of minutes)"""
+    typical = (ind['high'] + ind['low'] + ind['close']) / 3
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _rolling_sum(typical * ind['volume'], timeperiod) / _rolling_sum(ind['volume'], timeperiod)
+
+
+def prior_close(ind, timeperiod=1440):
+    """Close `timeperiod` rows ago (1440 = prior-day close)"""
+    out = np.full_like(ind['close'], np.nan)
+    out[timeperiod:] = ind['close'][:-timeperiod]
+    return out
+
+
+INDICATORS = {
+    # Original indicators from some boilerplate repo I started with
+    'sma15': dict(fn=_talib('SMA', timeperiod=15), lookback=15, width=1),
+    'sma60': dict(fn=_talib('SMA', timeperiod=60), lookback=60, width=1),
+    'rsi14': dict(fn=_talib('RSI', timeperiod=14), lookback=15, width=1),
+    'atr14': dict(fn=_talib('ATR', timeperiod=14), lookback=15, width=1),
+
+    # From the book "How to Day Trade For a Living": Price, Volume, 9-EMA, 20-EMA, 50-SMA, 200-SMA, VWAP, prior-day
+    # close. EMAs never entirely forget, ~4x the period is plenty for them to converge
+    'ema9': dict(fn=_talib('EMA', timeperiod=9), lookback=36, width=1),
+    'ema20': dict(fn=_talib('EMA', timeperiod=20), lookback=80, width=1),
+    'sma50': dict(fn=_talib('SMA', timeperiod=50), lookback=50, width=1),
+    'sma200': dict(fn=_talib('SMA', timeperiod=200), lookback=200, width=1),
+    'vwap': dict(fn=vwap, lookback=1440, width=1),
+    'prior_close': dict(fn=prior_close, lookback=1441, width=1),
+
+    # Upper, middle, lower bands
+    'bbands20': dict(fn=_talib('BBANDS', timeperiod=20), lookback=20, width=3),
+}
+
+BASE = ['sma15', 'sma60', 'rsi14', 'atr14']
+EXTRA = ['ema9', 'ema20', 'sma50', 'sma200', 'vwap', 'prior_close', 'bbands20']
+
+
+def selected(hypers):
+    """Indicator names (in column order) for these hypers"""
+    if not hypers.get('indicators'): return []
+    return BASE + (EXTRA if hypers.get('extra_indicators') else [])
+
+
+def width(names): return sum(INDICATORS[n]['width'] for n in names)
+
+
+def lookback(names): return max([INDICATORS[n]['lookback'] for n in names] or [0])
+
+
+def compute(ind, names):
+    """All of `names` for one table, in one (rows, width(names)) matrix"""
+    out = np.empty((len(ind['close']), width(names)))
+    j = 0
+    for name in names:
+        spec = INDICATORS[name]
+        res = spec['fn'](ind)
+        w = spec['width']
+        out[:, j:j+w] = np.column_stack(res) if w > 1 else res[:, None]
+        j += w
+    return out
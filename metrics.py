@@ -0,0 +1,138 @@
+"""Latency tracking for live-mode. Each span (feature update, agent act, order submit & round-trip, ...) keeps a rolling window
+of recent durations so we can report percentiles, eg when replaying history through the live path (replay.py). In
+run.py --live these also get emitted periodically (percentiles + histogram per span) as JSON lines to a local metrics
+file, for dashboards / alerting when decision latency degrades.
+
+Profiler is the training-side counterpart: opt-in cumulative per-stage timings for a whole run / hypersearch trial.
+"""
+
+import time, json
+from collections import defaultdict, deque
+from contextlib import contextmanager
+import numpy as np
+
+
+# Histogram bucket upper-bounds (ms); anything slower lands in a final +inf bucket
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000]
+
+
+class Latency(object):
+    def __init__(self, maxlen=10000, path=None, emit_every=60, alert_ms=None):
+        """
+        :param path: if set, emit() appends stats here as JSON lines
+        :param emit_every: maybe_emit() emits at most once per this many seconds
+        :param alert_ms: warn when p90 of the `tick_to_order` span goes over this
+        """
+        self.samples = defaultdict(lambda: deque(maxlen=maxlen))
+        self.path, self.emit_every, self.alert_ms = path, emit_every, alert_ms
+        self.last_emit = time.time()
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples[name].append(time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        """For spans that don't fit in a `with` (eg, from a new row arriving till the order it leads to)"""
+        self.samples[name].append(seconds)
+
+    def percentiles(self, qs=(50, 90, 99)):
+        """{span: {n, p50, p90, p99, max}}, durations in ms"""
+        ret = {}
+        for name, samples in self.samples.items():
+            if not samples: continue
+            ms = np.array(samples) * 1000
+            ret[name] = dict(n=len(ms), **{f'p{q}': np.percentile(ms, q) for q in qs}, max=ms.max())
+        return ret
+
+    def histograms(self):
+        """{span: [counts per BUCKETS (+inf last)]} over the rolling window"""
+        return {name: np.histogram(np.array(samples) * 1000, bins=[0] + BUCKETS + [np.inf])[0].tolist()
+                for name, samples in self.samples.items() if samples}
+
+    def emit(self):
+        self.last_emit = time.time()
+        stats = self.percentiles()
+        p90 = stats.get('tick_to_order', {}).get('p90')
+        if self.alert_ms and p90 and p90 > self.alert_ms:
+            print(f"WARNING: tick-to-order p90 {round(p90)}ms > {self.alert_ms}ms")
+        if not self.path: return
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(dict(time=self.last_emit, buckets=BUCKETS, percentiles=stats,
+                                    histograms=self.histograms())) + '\n')
+
+    def maybe_emit(self):
+        if time.time() - self.last_emit >= self.emit_every:
+            self.emit()
+
+    def report(self):
+        for name, stats in sorted(self.percentiles().items()):
+            print(f"{name}\t" + '\t'.join(f"{k}:{round(v, 2)}" for k, v in stats.items()))
+
+
+class _Span(object):
+    # Plain __enter__/__exit__ rather than @contextmanager, some of these are per-step
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler, self.name = profiler, name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, time.perf_counter() - self.start)
+
+
+class _NullSpan(object):
+    def __enter__(self): pass
+
+    def __exit__(self, *exc): pass
+
+NULL_SPAN = _NullSpan()
+
+
+class Profiler(object):
+    """Where does a training run / hypersearch trial spend its time? Cumulative seconds & call-counts per named stage
+    (data loading, features, scaling, act, observe/update, test-runs, DB...), plus free-form counters. Opt-in: when
+    disabled, span() hands back a shared no-op and wrap() returns the fn untouched, so it costs next to nothing.
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.totals = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+
+    def span(self, name):
+        return _Span(self, name) if self.enabled else NULL_SPAN
+
+    def add(self, name, seconds):
+        self.totals[name] += seconds
+        self.calls[name] += 1
+
+    def count(self, name, n=1):
+        if self.enabled: self.counters[name] += n
+
+    def wrap(self, name, fn):
+        """Time every call of fn (eg agent.act, which we don't own)"""
+        if not self.enabled: return fn
+        def wrapped(*args, **kwargs):
+            with self.span(name):
+                return fn(*args, **kwargs)
+        return wrapped
+
+    def summary(self):
+        """{stage: {n, total_s, mean_ms}, counters: {...}}, JSON-friendly (saved w/ the run)"""
+        ret = {name: dict(n=self.calls[name], total_s=round(total, 3), mean_ms=round(total / self.calls[name] * 1000, 3))
+               for name, total in self.totals.items()}
+        if self.counters: ret['counters'] = dict(self.counters)
+        return ret
+
+    def report(self):
+        for name, total in sorted(self.totals.items(), key=lambda x: -x[1]):
+            print(f"{name}\tn:{self.calls[name]}\ttotal:{round(total, 2)}s\tmean:{round(total / self.calls[name] * 1000, 3)}ms")
+        for name, n in self.counters.items():
+            print(f"{name}\t{n}")
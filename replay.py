@@ -0,0 +1,66 @@
+"""
+Replays stored history through the live code-path (run.py --live), at some speed-up, against a simulated exchange.
+Use it to exercise live-mode (fetching, re-transforming, ordering, episode_finished) without waiting for real minutes
+to pass, and to measure per-tick latency of each stage - for capacity-planning the live box and catching latency
+regressions before deploying. Takes the same model args as run.py (train it with run.py first).
+
+Eg `python replay.py --id 10 --rows 20000 --speedup 1000`. The first 6000 rows are live-mode's warm-up, each row after
+that is one tick.
+"""
+
+import argparse
+from concurrent import futures
+from tensorforce.agents import agents as agents_dict
+
+from data import data
+from btc_env import BitcoinEnv
+from hypersearch import HSearchEnv
+from exchange import AsyncExchange, SimExchange
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-g', '--gpu_split', type=float, default=1, help="Num ways we'll split the GPU (how many tabs you running?)")
+parser.add_argument('--id', type=int, help="Load winner from DB or hard-coded guess?")
+parser.add_argument('--early-stop', type=int, default=-1, help="Same as run.py, to find the saved model's directory")
+parser.add_argument('--net-type', type=str, default='conv2d')
+parser.add_argument('--rows', type=int, default=10000, help="Num history rows to replay (incl the 6000 warm-up)")
+parser.add_argument('--offset', type=int, default=0, help="Replay starting this many rows back from the most recent")
+parser.add_argument('--speedup', type=float, default=0, help="Replay 1-min rows this many times faster than real-time, 0 for as-fast-as-possible")
+parser.add_argument('--test-live', action="store_true", default=False, help="Don't place (simulated) orders")
+args = parser.parse_args()
+
+
+def main():
+    directory = f'./saves/{args.id}{"_early" if args.early_stop else ""}'
+
+    hs = HSearchEnv(gpu_split=args.gpu_split, net_type=args.net_type)
+    flat, hydrated, network = hs.get_winner(id=args.id)
+    env = BitcoinEnv(flat, name='ppo_agent')
+    agent = agents_dict['ppo_agent'](
+        saver_spec=dict(directory=directory, steps=6000),
+        states_spec=env.states,
+        actions_spec=env.actions,
+        network_spec=network,
+        **hydrated
+    )
+
+    history = data.db_to_dataframe(env.conn, limit=args.rows, offset=args.offset, arbitrage=flat['arbitrage'])
+    env.feed = data.ReplayFeed(history, speedup=args.speedup)
+    sim = SimExchange(price_fn=lambda: env.prices[-1], usd=1000., btc=1000. / env.btc_price)
+
+    try:
+        env.run_live(agent, test=args.test_live, client=sim)
+    except data.ReplayFinished:
+        pass
+
+    # Collect the last orders' round-trips (order_rtt)
+    futures.wait([f for _, _, f in env.exchange.pending], timeout=AsyncExchange.TIMEOUT)
+    env.exchange.reconcile()
+    print('\n--- Per-tick latency (ms) ---')
+    env.latency.report()
+    print(f"\nSimulated balances: ${round(sim.usd, 2)}, {round(sim.btc, 4)}BTC ({len(sim.orders)} orders)")
+    agent.close()
+    env.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -6,11 +6,14 @@ plus --live/--test-live.
 """
 
 import argparse
-from tensorforce.agents import agents as agents_dict
 import shutil
 
 import data
+import btc_env
 from btc_env import BitcoinEnv
+from exchange import SimExchange
+from metrics import Latency, Profiler
+import inference
 from hypersearch import HSearchEnv
 
 parser = argparse.ArgumentParser()
@@ -19,39 +22,80 @@ parser.add_argument('--id', type=int, help="Load winner from DB or hard-coded gu
 parser.add_argument('--runs', type=int, default=40, help="Number of test-runs")
 parser.add_argument('--live', action="store_true", default=False, help="Run in live mode")
 parser.add_argument('--test-live', action="store_true", default=False, help="Dry-run live mode")
+parser.add_argument('--sim-live', action="store_true", default=False, help="Live mode against a local simulated exchange")
+parser.add_argument('--metrics', type=str, default='live_metrics.jsonl', help="Live mode: file to append latency stats to (JSON lines)")
+parser.add_argument('--alert-ms', type=float, default=None, help="Live mode: warn when p90 tick-to-order latency exceeds this")
+parser.add_argument('--full-agent', action="store_true", default=False, help="Live mode: restore the full PPO agent instead of the exported inference-only policy")
+parser.add_argument('--xform-procs', type=int, default=0, help="Compute features in parallel w/ this many processes (see btc_env.XFORM_PROCS)")
+parser.add_argument('--profile', action="store_true", default=False, help="Print a per-stage timing breakdown after training")
+parser.add_argument('--async-tests', action="store_true", default=False, help="Run each test-round on a snapshot of the agent while training continues")
+parser.add_argument('--resume', action="store_true", default=False, help="Carry on training from the last checkpoint (rather than wiping the save directory & starting over)")
 parser.add_argument('--early-stop', type=int, default=-1, help="Stop model after x successful runs")
 parser.add_argument('--net-type', type=str, default='conv2d')  # todo pull this from winner automatically
 args = parser.parse_args()
 
 
 def main():
+    btc_env.XFORM_PROCS = args.xform_procs
     directory = f'./saves/{args.id}{"_early" if args.early_stop else ""}'
-    if not args.live and not args.test_live:
+    live = args.live or args.test_live or args.sim_live
+    if not live and not args.resume:
         try: shutil.rmtree(directory)
         except: pass
 
     hs = HSearchEnv(gpu_split=args.gpu_split, net_type=args.net_type)
     flat, hydrated, network = hs.get_winner(id=args.id)
     env = BitcoinEnv(flat, name='ppo_agent')
-    agent = agents_dict['ppo_agent'](
-        saver_spec=dict(
-            directory=directory,
-            # saves this model every 6000 time-steps. I'd rather manually save it at the end, that way we could save
-            # a winning combo in hypersearch.py and remove this redundant training step - but TForce doesn't have
-            # working manual-save code yet, only automatic.
-            steps=6000
-        ),
-        states_spec=env.states,
-        actions_spec=env.actions,
-        network_spec=network,
-        **hydrated
-    )
-
-    if args.live or args.test_live:
+    if live:
+        env.latency = Latency(path=args.metrics, alert_ms=args.alert_ms)
+    env.profiler = Profiler(enabled=args.profile)
+
+    policy_path = f'{directory}/policy'
+    if live and not args.full_agent and inference.exists(policy_path):
+        agent = inference.InferencePolicy(policy_path, session_config=hydrated['session_config'])
+    else:
+        from tensorforce.agents import agents as agents_dict
+        agent = agents_dict['ppo_agent'](
+            saver_spec=dict(
+                directory=directory,
+                # saves this model every 6000 time-steps. I'd rather manually save it at the end, that way we could
+                # save a winning combo in hypersearch.py and remove this redundant training step - but TForce doesn't
+                # have working manual-save code yet, only automatic.
+                steps=6000
+            ),
+            states_spec=env.states,
+            actions_spec=env.actions,
+            network_spec=network,
+            **hydrated
+        )
+
+    eval_agent = None
+    if args.async_tests and not live:
+        from tensorforce.agents import agents as agents_dict
+        # Test-rounds run on a copy of the agent (w/o a saver) while this one trains, see btc_env.AsyncTester
+        eval_agent = agents_dict['ppo_agent'](
+            states_spec=env.states,
+            actions_spec=env.actions,
+            network_spec=network,
+            **hydrated
+        )
+
+    if args.sim_live:
+        # Fills against the latest price in the live DB, starting w/ ~$1k each side
+        sim = SimExchange(price_fn=lambda: env.prices[-1], usd=1000., btc=1000. / env.btc_price)
+        env.run_live(agent, test=False, client=sim)
+    elif live:
         env.run_live(agent, test=args.test_live)
     else:
-        env.train_and_test(agent, early_stop=args.early_stop, n_tests=args.runs)
+        # Checkpointed every test-round, so --resume can carry on if this dies partway. Not `{directory}/checkpoint`,
+        # that's the TF saver's checkpoint-state file (saver_spec above)
+        env.train_and_test(agent, early_stop=args.early_stop, n_tests=args.runs, eval_agent=eval_agent,
+                           checkpoint=f'{directory}/resume')
+        if args.profile: env.profiler.report()
+        # Freeze just the policy's forward pass for live-mode (see inference.py)
+        inference.export_policy(agent, policy_path)
         agent.close()
+        if eval_agent: eval_agent.close()
         env.close()
 
 
@@ -3,6 +3,7 @@ from data import data
 from data.data import F, Z
 from btc_env import BitcoinEnv, Mode
 from hypersearch import HSearchEnv
+import features
 import pandas as pd
 
 COUNT = 101
@@ -50,6 +51,7 @@ def main():
     data.target = 'a_c'
     data.count_rows = count_rows
     data.db_to_dataframe = db_to_dataframe_wrapper(1)
+    features.CACHE_DIR = features.SHM_DIR = None  # same key for the bull & bear data below
 
     env = BitcoinEnv(flat, name='ppo_agent')
 
@@ -0,0 +1,135 @@
+"""Checks the agent save -> restore paths on real (small) agents & synthetic data: AsyncTester's per-round snapshot
+into the eval agent, train_and_test()'s checkpoint -> resume (w/ & w/o a saver directory, as in hypersearch.py &
+run.py), and inference.py's export -> InferencePolicy. `python test_checkpoint.py`"""
+
+import os, shutil, tempfile
+import numpy as np
+from benchmarks import synthetic
+from btc_env import BitcoinEnv, AsyncTester, Mode
+from hypersearch import HSearchEnv
+import inference
+
+
+def weights(agent):
+    model = agent.model
+    return model.session.run(model.get_variables())
+
+
+def same(a, b): return all(np.array_equal(x, y) for x, y in zip(weights(a), weights(b)))
+
+
+def make_agent(env, network, hydrated, saver_dir=None):
+    from tensorforce.agents import agents as agents_dict
+    # No saver_spec by default, same as hypersearch's trial agents & the eval agents; run.py's agent has one
+    saver_spec = dict(directory=saver_dir, steps=6000) if saver_dir else None
+    return agents_dict['ppo_agent'](saver_spec=saver_spec, states_spec=env.states, actions_spec=env.actions,
+                                    network_spec=network, **hydrated)
+
+
+def check_snapshot(env, network, hydrated):
+    agent, eval_agent = make_agent(env, network, hydrated), make_agent(env, network, hydrated)
+    assert not same(agent, eval_agent), "expected separately initialized agents to differ"
+    tester = AsyncTester(env, eval_agent)
+    try:
+        tester.submit(agent)
+        tester.collect()  # raises whatever the test-round did
+        assert same(agent, eval_agent), "eval agent didn't get the training agent's weights"
+        assert len(env.acc.episode.advantages) == 1, env.acc.episode.advantages
+    finally:
+        tester.close()
+        agent.close()
+        eval_agent.close()
+
+
+def check_resume(env, network, hydrated, saver):
+    tmp = tempfile.mkdtemp()
+    # Relative, like run.py's ./saves/<id>
+    saver_dir = os.path.relpath(f'{tmp}/saves') if saver else None
+    path = f'{saver_dir or tmp}/resume'
+    agent = make_agent(env, network, hydrated, saver_dir)
+    resumed = make_agent(env, network, hydrated, saver_dir)
+    try:
+        env.acc.episode.advantages[:] = [.1, .2, .3]
+        env._checkpoint(path, agent, 2, pending=True)
+        assert env._resume(path, resumed) == (2, True)
+        assert same(agent, resumed), "resumed agent didn't get the checkpoint's weights"
+        assert list(env.acc.episode.advantages) == [.1, .2, .3]
+        # Only the latest round's files are kept
+        env._checkpoint(path, agent, 3, pending=False)
+        assert not [f for f in os.listdir(path) if f.startswith('round2')], os.listdir(path)
+        assert env._resume(path, resumed) == (3, False)
+    finally:
+        agent.close()
+        resumed.close()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def ungated_merges(graph_def):
+    """tf.cond Merges w/ an input that doesn't hang off the cond's Switch (by data or control edge), so both branches
+    run & the Merge passes on whichever finishes first"""
+    inputs = {node.name: [i.lstrip('^').split(':')[0] for i in node.input] for node in graph_def.node}
+    ops = {node.name: node.op for node in graph_def.node}
+
+    def gated(name):
+        stack, seen = [name], {name}
+        while stack:
+            name = stack.pop()
+            if ops[name] == 'Switch': return True
+            stack.extend(i for i in inputs[name] if i not in seen)
+            seen.update(inputs[name])
+        return False
+    return [name for name, op in ops.items() if op == 'Merge' and not all(gated(i) for i in inputs[name])]
+
+
+def check_export(env, network, hydrated, n_steps=50):
+    tmp = tempfile.mkdtemp()
+    agent = make_agent(env, network, hydrated)
+    policy = None
+    try:
+        inference.export_policy(agent, f'{tmp}/policy')
+        policy = inference.InferencePolicy(f'{tmp}/policy')
+        # Which branch wins an ungated Merge is up to the executor, so parity below could pass by luck
+        assert not ungated_merges(policy.graph.as_graph_def()), ungated_merges(policy.graph.as_graph_def())
+        # Same states through both, a few times over (internals carry across steps for lstm). The winner's guesses
+        # have dropout on, which must stay off outside of updates
+        env.use_dataset(Mode.TEST)
+        for _ in range(3):
+            agent.reset()
+            policy.reset()
+            states = env.reset()
+            for _ in range(n_steps):
+                expected = agent.act(states, deterministic=True)
+                actual = policy.act(states)
+                if isinstance(expected, dict):
+                    assert all(np.allclose(expected[k], actual[k]) for k in expected), (expected, actual)
+                else:
+                    assert np.allclose(expected, actual), (expected, actual)
+                states, terminal, _ = env.execute(expected)
+                if terminal: break
+    finally:
+        if policy: policy.close()
+        agent.close()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main():
+    tables = synthetic.make_tables(1)
+    synthetic.use_synthetic(synthetic.random_walk(3000, tables), tables)
+    for net_type in ['conv2d', 'lstm']:
+        hs = HSearchEnv(net_type=net_type)
+        flat, hydrated, network = hs.get_winner()
+        hs.close()
+        flat.update(indicators=False, arbitrage=False)
+        env = BitcoinEnv(flat, name='ppo_agent')
+        check_snapshot(env, network, hydrated)
+        print(f"{net_type}: snapshot -> eval agent OK")
+        for saver in [False, True]:
+            check_resume(env, network, hydrated, saver)
+            print(f"{net_type}: checkpoint -> resume ({'w/' if saver else 'w/o'} saver directory) OK")
+        check_export(env, network, hydrated)
+        print(f"{net_type}: exported policy matches agent.act() OK")
+        env.close()
+
+
+if __name__ == '__main__':
+    main()
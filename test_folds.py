@@ -0,0 +1,38 @@
+"""Checks BitcoinEnv's walk-forward windows (btc_env.fold_window). `python test_folds.py`"""
+
+from btc_env import fold_window
+
+
+def main():
+    n_rows, n_folds = 1000, 3
+    tests = [fold_window(n_rows, k, n_folds, test=True) for k in range(n_folds)]
+    trains = [fold_window(n_rows, k, n_folds) for k in range(n_folds)]
+
+    # Test windows: the most recent 10% slices, back to back, fold 0 most recent
+    assert tests == [(900, 1000), (800, 900), (700, 800)], tests
+    for (train_start, train_end), (test_start, test_end) in zip(trains, tests):
+        # Each fold trains right up to its test window, never on or past it; all the same length
+        assert train_end == test_start, (train_start, train_end, test_start)
+        assert train_end - train_start == n_rows - n_folds * 100
+        assert train_start >= 0
+    # The oldest fold's training starts at the beginning of history
+    assert trains[-1][0] == 0, trains
+
+    # Low fidelity trains on the most recent slice of the fold's span
+    assert fold_window(n_rows, 1, n_folds, fidelity=.5) == (450, 800)
+    assert fold_window(n_rows, 1, n_folds, fidelity=.5, test=True) == (800, 900)
+
+    # A single fold is the usual split, train then test
+    assert fold_window(n_rows, 0, 1) == (0, 900) and fold_window(n_rows, 0, 1, test=True) == (900, 1000)
+
+    # Not enough history left to train on
+    try:
+        fold_window(n_rows, 0, 9)
+        assert False, "expected too many folds to fail"
+    except AssertionError as e:
+        assert 'Too many folds' in str(e), e
+    print("Walk-forward windows OK")
+
+
+if __name__ == '__main__':
+    main()
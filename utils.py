@@ -10,6 +10,11 @@ class ScoreMode(Enum):
 
 MODE = ScoreMode.MEAN
 
+# Pruning (see BitcoinEnv.train_and_test). Don't judge a trial until it's had this many test-rounds, and don't judge
+# it at all until there are enough past runs which made it this far to compare against.
+PRUNE_MIN_ROUNDS = 5
+PRUNE_MIN_RUNS = 10
+
 
 def calculate_score(run):
     advantages = run['advantages']
@@ -32,6 +37,46 @@ def calculate_score(run):
         return score
 
 
+def make_pruner(curves, percentile=25):
+    """Median-stopping rule (generalized to any percentile). `curves` are the `advantages` arrays of past runs. After
+    each test-round, the trial's running-mean advantage is compared to the running-means of past runs at the same
+    round; if it's in the bottom `percentile`, we give up on it. Returns fn(advantages) -> True if the trial should stop.
+    """
+    curves = [np.cumsum(c) / np.arange(1, len(c) + 1) for c in curves if c]
+
+    def should_prune(advantages):
+        i = len(advantages)
+        if i < PRUNE_MIN_ROUNDS: return False
+        others = [c[i-1] for c in curves if len(c) >= i]
+        if len(others) < PRUNE_MIN_RUNS: return False
+        return np.mean(advantages) < np.percentile(others, percentile)
+    return should_prune
+
+
+class RingBuffer(object):
+    """Fixed-capacity buffer of rows, for live-mode's otherwise ever-growing data. Each row is written twice,
+    `capacity` apart, so the most recent rows are always one contiguous slice (view()) - no copying/np.roll on append.
+    """
+    def __init__(self, capacity, n_cols, dtype=np.float64):
+        self.capacity = capacity
+        self.arr = np.zeros((capacity * 2, n_cols), dtype=dtype)
+        self.start, self.n = 0, 0
+
+    def extend(self, rows):
+        rows = np.asarray(rows)[-self.capacity:]
+        pos = (self.start + self.n + np.arange(len(rows))) % self.capacity
+        self.arr[pos] = rows
+        self.arr[pos + self.capacity] = rows
+        overflow = max(0, self.n + len(rows) - self.capacity)
+        self.start = (self.start + overflow) % self.capacity
+        self.n = min(self.n + len(rows), self.capacity)
+
+    def view(self):
+        return self.arr[self.start:self.start + self.n]
+
+    def __len__(self): return self.n
+
+
 # One array per running instance (ie, if you have 2 separate tabs running hypersearch.py, then you'll want an array of
 # two arrays. `--guess 0` will go through all the overrides in the first array, `--guess 1` all the overrides in the
 # second array
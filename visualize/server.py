@@ -1,7 +1,7 @@
 # Run as $ FLASK_APP=server.py flask run
 import json, pdb, pprint
 from flask import Flask, jsonify
-from data.data import engine_runs
+from data.data import engine_runs, unpack_array
 from flask_cors import CORS
 from sqlalchemy import create_engine, text
 import utils
@@ -28,9 +28,17 @@ def get_runs():
 @app.route("/actions/<run_id>")
 def get_actions(run_id):
     conn = engine_runs.connect()
-    query = 'select actions, prices from runs where id=:run_id'
+    query = """
+      select r.actions, r.prices, r.actions_z, d.prices as prices_z 
+      from runs r left join datasets d on d.id=r.dataset_id 
+      where r.id=:run_id
+    """
     row = conn.execute(text(query), run_id=run_id).fetchone()
     conn.close()
 
-    return jsonify(dict(row))
+    # Older runs have actions/prices inline, newer ones compressed (see data.save_prices)
+    return jsonify(dict(
+        actions=unpack_array(row.actions_z).tolist() if row.actions_z else row.actions,
+        prices=unpack_array(row.prices_z).tolist() if row.prices_z else row.prices
+    ))
 